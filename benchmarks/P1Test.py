@@ -56,6 +56,16 @@ class P1Test(object):
         gdb.remove(self.edges)
         self.validate_empty_edges(gdb)
 
+        print(f'--- Transactions')
+        with gdb.transaction():
+            for e in self.edges:
+                gdb.add(e)
+        self.validate_contents(gdb)
+        with gdb.transaction():
+            for e in self.edges:
+                gdb.remove(e)
+        self.validate_empty_edges(gdb)
+
         gdb.clear()
         print(f'--- Bulk Insert')
         import_graph(gdb, self.conf.test_dataset['path'])
@@ -97,6 +107,54 @@ class P1Test(object):
             f'reduce_edges: {gdb.reduce_edges(None, 5)}'
         assert gdb.reduce_edges(5, None) == GraphDegree(1, 2.0), \
             f'reduce_edges: {gdb.reduce_edges(5, None)}'
+        self.validate_batched_reads(gdb)
+
+    def validate_batched_reads(self, gdb):
+        """
+            Every batched or specialized call must match
+            its one-by-one equivalent or the known contents.
+        """
+        def members_and_weights(es):
+            return sorted((e.first, e.second, float(e.weight)) for e in es)
+
+        # Repeated, inverted and missing pairs are included on purpose.
+        pairs = [(e.first, e.second) for e in self.edges] + [(1, 2), (2, 1), (1, 3)]
+        one_by_one = [members_and_weights(gdb.has_edge(u, v)) for u, v in pairs]
+        batched = [members_and_weights(es) for es in gdb.has_edges(pairs)]
+        assert batched == one_by_one, \
+            f'has_edges: {batched}'
+        cnt_matching = sum(1 for es in one_by_one if len(es) > 0)
+        assert gdb.count_matching_pairs(pairs) == cnt_matching, \
+            f'count_matching_pairs: {gdb.count_matching_pairs(pairs)}'
+
+        vs = list(range(1, 9)) + [1]
+        neighbors = [set(gdb.neighbors(v)) for v in vs]
+        assert [set(related) for related in gdb.neighbors_many(vs)] == neighbors, \
+            f'neighbors_many: {gdb.neighbors_many(vs)}'
+        followers = [gdb.number_of_edges(None, v) for v in vs]
+        assert list(gdb.count_followers_many(vs)) == followers, \
+            f'count_followers_many: {gdb.count_followers_many(vs)}'
+        following = [gdb.number_of_edges(v, None) for v in vs]
+        assert list(gdb.count_following_many(vs)) == following, \
+            f'count_following_many: {gdb.count_following_many(vs)}'
+
+        for v in vs:
+            expected_from = members_and_weights(e for e in self.edges if e.first == v)
+            assert members_and_weights(gdb.edges_from(v)) == expected_from, \
+                f'edges_from: {gdb.edges_from(v)}'
+            expected_to = members_and_weights(e for e in self.edges if e.second == v)
+            assert members_and_weights(gdb.edges_to(v)) == expected_to, \
+                f'edges_to: {gdb.edges_to(v)}'
+            assert members_and_weights(gdb.edges_related(v)) == sorted(expected_from + expected_to), \
+                f'edges_related: {gdb.edges_related(v)}'
+
+        streamed = [e for es in gdb.iterate_edge_chunks(chunk_len=3) for e in es]
+        assert sorted((u, v, float(w)) for u, v, w in streamed) == members_and_weights(self.edges), \
+            f'iterate_edge_chunks: {streamed}'
+        assert gdb.count_mentioned_nodes() == 8, \
+            f'count_mentioned_nodes: {gdb.count_mentioned_nodes()}'
+        assert gdb.count_edges() == 10, \
+            f'count_edges: {gdb.count_edges()}'
 
 
 if __name__ == "__main__":
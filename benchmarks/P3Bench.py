@@ -1,5 +1,5 @@
 import os
-from time import time
+import threading
 
 from pystats2md.stats_file import StatsFile
 from pystats2md.micro_bench import MicroBench
@@ -20,9 +20,15 @@ class P3Bench(object):
         5. Clearing all the data (if needed).
     """
 
-    def __init__(self, max_seconds_per_query=60):
+    def __init__(self, max_seconds_per_query=60, max_lookups_per_batch=100):
         self.conf = P0Config.shared()
         self.max_seconds_per_query = max_seconds_per_query
+        # Set by a timer thread, once the running task is out of time.
+        # Reading it is much cheaper than querying the clock.
+        self.time_is_up = threading.Event()
+        # Batched lookups amortize round-trips, but the deadline
+        # is only checked between batches.
+        self.max_lookups_per_batch = max_lookups_per_batch
         self.tasks = P3TasksSampler()
 
     def run(self, repeat_existing=False):
@@ -44,7 +50,7 @@ class P3Bench(object):
         if self.gdb is None:
             return
         is_in_ram = bool(type(self.gdb).__in_memory__)
-        if (self.gdb.number_of_edges() == 0) and (not is_in_ram):
+        if (self.gdb.count_edges() == 0) and (not is_in_ram):
             return
         print('- Benchmarking: {} @ {}'.format(
             self.dataset['name'],
@@ -144,7 +150,15 @@ class P3Bench(object):
                 print('--- Skipping!')
                 return
         print('---- Running!')
-        counter.run()
+        self.time_is_up.clear()
+        timer = threading.Timer(
+            self.max_seconds_per_query, self.time_is_up.set)
+        timer.daemon = True
+        timer.start()
+        try:
+            counter.run()
+        finally:
+            timer.cancel()
         if counter.count_operations == 0:
             print('---- Didn\'t measure!')
             return
@@ -155,10 +169,7 @@ class P3Bench(object):
     # ---
 
     def stream_es(self) -> int:
-        cnt = 0
-        for e in self.gdb.edges:
-            cnt += 1
-        return cnt
+        return sum(len(es) for es in self.gdb.iterate_edge_chunks())
 
     def stream_ns(self) -> int:
         cnt = 0
@@ -169,13 +180,16 @@ class P3Bench(object):
     def find_e(self) -> int:
         cnt = 0
         cnt_found = 0
-        t0 = time()
-        for e in self.tasks.edges_to_query:
-            match = self.gdb.has_edge(e.first, e.second)
-            cnt += 1
-            cnt_found += 0 if (match is None) else 1
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+        count_matching_pairs = self.gdb.count_matching_pairs
+        time_is_up = self.time_is_up.is_set
+        firsts = self.tasks.firsts_to_query
+        seconds = self.tasks.seconds_to_query
+        batch_len = self.max_lookups_per_batch
+        for i in range(0, len(firsts), batch_len):
+            pairs = list(zip(firsts[i:i+batch_len], seconds[i:i+batch_len]))
+            cnt += len(pairs)
+            cnt_found += count_matching_pairs(pairs)
+            if time_is_up():
                 break
         print(f'---- {cnt} ops: {cnt_found} undirected matches')
         return cnt
@@ -183,13 +197,12 @@ class P3Bench(object):
     def find_es_related(self) -> int:
         cnt = 0
         cnt_found = 0
-        t0 = time()
+        edges_related = self.gdb.edges_related
+        time_is_up = self.time_is_up.is_set
         for v in self.tasks.nodes_to_query:
-            es = self.gdb.has_edge(v, v)
+            cnt_found += len(edges_related(v))
             cnt += 1
-            cnt_found += len(es)
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+            if time_is_up():
                 break
         print(f'---- {cnt} ops: {cnt_found} edges found')
         return cnt
@@ -197,13 +210,12 @@ class P3Bench(object):
     def find_es_from(self) -> int:
         cnt = 0
         cnt_found = 0
-        t0 = time()
+        edges_from = self.gdb.edges_from
+        time_is_up = self.time_is_up.is_set
         for v in self.tasks.nodes_to_query:
-            es = self.gdb.has_edge(v, None)
+            cnt_found += len(edges_from(v))
             cnt += 1
-            cnt_found += len(es)
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+            if time_is_up():
                 break
         print(f'---- {cnt} ops: {cnt_found} edges found')
         return cnt
@@ -211,13 +223,12 @@ class P3Bench(object):
     def find_es_to(self) -> int:
         cnt = 0
         cnt_found = 0
-        t0 = time()
+        edges_to = self.gdb.edges_to
+        time_is_up = self.time_is_up.is_set
         for v in self.tasks.nodes_to_query:
-            es = self.gdb.has_edge(None, v)
+            cnt_found += len(edges_to(v))
             cnt += 1
-            cnt_found += len(es)
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+            if time_is_up():
                 break
         print(f'---- {cnt} ops: {cnt_found} edges found')
         return cnt
@@ -225,76 +236,76 @@ class P3Bench(object):
     def find_vs_related(self) -> int:
         cnt = 0
         cnt_found = 0
-        t0 = time()
-        for v in self.tasks.nodes_to_query:
-            vs = self.gdb.neighbors(v)
-            cnt += 1
-            cnt_found += len(vs)
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+        neighbors_many = self.gdb.neighbors_many
+        time_is_up = self.time_is_up.is_set
+        for vs_batch in chunks(self.tasks.nodes_to_query, self.max_lookups_per_batch):
+            for vs in neighbors_many(vs_batch):
+                cnt += 1
+                cnt_found += len(vs)
+            if time_is_up():
                 break
         print(f'---- {cnt} ops: {cnt_found} related nodes')
         return cnt
 
     def count_v_related(self) -> int:
         cnt = 0
-        t0 = time()
+        count_related = self.gdb.count_related
+        time_is_up = self.time_is_up.is_set
         for v in self.tasks.nodes_to_query:
-            self.gdb.number_of_edges(v, v)
+            count_related(v)
             cnt += 1
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+            if time_is_up():
                 break
         return cnt
 
     def count_v_followers(self) -> int:
         cnt = 0
-        t0 = time()
-        for v in self.tasks.nodes_to_query:
-            self.gdb.number_of_edges(None, v)
-            cnt += 1
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+        count_followers_many = self.gdb.count_followers_many
+        time_is_up = self.time_is_up.is_set
+        for vs in chunks(self.tasks.nodes_to_query, self.max_lookups_per_batch):
+            cnt += len(count_followers_many(vs))
+            if time_is_up():
                 break
         return cnt
 
     def count_v_following(self) -> int:
         cnt = 0
-        t0 = time()
-        for v in self.tasks.nodes_to_query:
-            self.gdb.number_of_edges(v, None)
-            cnt += 1
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+        count_following_many = self.gdb.count_following_many
+        time_is_up = self.time_is_up.is_set
+        for vs in chunks(self.tasks.nodes_to_query, self.max_lookups_per_batch):
+            cnt += len(count_following_many(vs))
+            if time_is_up():
                 break
         return cnt
 
     def find_vs_related_related(self) -> int:
         cnt = 0
         cnt_found = 0
-        t0 = time()
+        neighbors_of_neighbors = self.gdb.neighbors_of_neighbors
+        time_is_up = self.time_is_up.is_set
         for v in self.tasks.nodes_to_analyze:
-            vs = self.gdb.neighbors_of_neighbors(v)
+            vs = neighbors_of_neighbors(v)
             cnt += 1
             cnt_found += len(vs)
-            dt = time() - t0
-            if dt > self.max_seconds_per_query:
+            if time_is_up():
                 break
         print(f'---- {cnt} ops: {cnt_found} related to related nodes')
         return cnt
 
     def remove_e(self) -> int:
         cnt = 0
-        for e in self.tasks.edges_to_change_by_one:
-            self.gdb.remove(e)
-            cnt += 1
+        with self.gdb.transaction():
+            for e in self.tasks.edges_to_change_by_one:
+                self.gdb.remove(e)
+                cnt += 1
         return cnt
 
     def upsert_e(self) -> int:
         cnt = 0
-        for e in self.tasks.edges_to_change_by_one:
-            self.gdb.add(e)
-            cnt += 1
+        with self.gdb.transaction():
+            for e in self.tasks.edges_to_change_by_one:
+                self.gdb.add(e)
+                cnt += 1
         return cnt
 
     def remove_es(self) -> int:
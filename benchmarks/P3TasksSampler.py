@@ -1,4 +1,5 @@
 import random
+from array import array
 from typing import List
 
 from PyStorageHelpers import *
@@ -22,7 +23,10 @@ class P3TasksSampler(object):
         self.clear()
 
     def clear(self):
-        self.edges_to_query = []
+        # Members of edges to lookup are kept in separate
+        # compact columns, rather than as `Edge` objects.
+        self.firsts_to_query = array('q')
+        self.seconds_to_query = array('q')
         self.nodes_to_query = []
         self.nodes_to_analyze = []
         self.edges_to_change_by_one = []
@@ -51,17 +55,20 @@ class P3TasksSampler(object):
             second = random.randrange(1, number_of_nodes)
             if first == second:
                 continue
-            self._buffer_edges.append({
-                'first': first,
-                'second': second,
-            })
+            # Explicit IDs keep `upsert_e` from overwriting a single row.
+            self._buffer_edges.append(Edge(
+                _id=Edge.identify_by_members(first, second),
+                first=first,
+                second=second,
+            ))
         self._split_samples_into_tasks()
         return len(self._buffer_edges)
 
     def _split_samples_into_tasks(self):
         self.count_finds = min(len(self._buffer_edges), self.count_finds)
-        self.edges_to_query = random.sample(
-            self._buffer_edges, self.count_finds)
+        es = random.sample(self._buffer_edges, self.count_finds)
+        self.firsts_to_query = array('q', [e.first for e in es])
+        self.seconds_to_query = array('q', [e.second for e in es])
         self.nodes_to_query = self._sample_nodes_from_edges(
             self.count_finds)
         self.nodes_to_analyze = self._sample_nodes_from_edges(
@@ -1,10 +1,27 @@
 from abc import ABC, abstractmethod
-from typing import Sequence, Optional, Dict, Generator, Set, Tuple, Sequence
+from contextlib import contextmanager
+from typing import List, Sequence, Optional, Dict, Generator, Set, FrozenSet, Tuple, Sequence
 import concurrent.futures
 import collections
+import functools
+import threading
 
-from .helpers import Edge, GraphDegree, Node
-from .helpers.Algorithms import is_sequence_of, chunks
+from .helpers import Edge, GraphDegree, Node, SegmentedCache
+from .helpers.Algorithms import is_sequence_of, chunks, sort_edges_by_members
+
+
+def invalidates_caches(method):
+    """
+        Marks methods that modify the graph contents.
+        Once such method returns, all the cached query results are dropped.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.invalidate_caches()
+    return wrapper
 
 
 class BaseAPI(object):
@@ -27,6 +44,8 @@ class BaseAPI(object):
     __edge_type__ = Edge
     __node_type__ = Node
     __in_memory__ = False
+    # Upper bound for the number of per-node query results kept in RAM.
+    __max_cache_size__ = 100000
 
     def __init__(
         self,
@@ -39,6 +58,19 @@ class BaseAPI(object):
         self.directed = directed
         self.weighted = weighted
         self.multigraph = multigraph
+        # Counting edges is often a full scan, but the results
+        # stay valid until the next write.
+        self._n_edges_cache = None
+        self._count_related_cached = functools.lru_cache(
+            maxsize=type(self).__max_cache_size__)(self._count_related)
+        # Hubs of power-law graphs reappear in many neighborhood queries,
+        # while one-off lookups only churn the admission window.
+        self._neighbors_cache = SegmentedCache(type(self).__max_cache_size__)
+        # Writers can run in other threads, so the cache is only
+        # accessed under the lock. The generation counter tells,
+        # if the graph was modified while a batch was being fetched.
+        self._neighbors_lock = threading.Lock()
+        self._neighbors_generation = 0
 
 # region Metadata
 
@@ -63,11 +95,50 @@ class BaseAPI(object):
         cnt_registered = self.reduce_nodes().count
         if cnt_registered > 0:
             return cnt_registered
+        return self.count_mentioned_nodes()
+
+    def count_mentioned_nodes(self) -> int:
+        """
+            Number of distinct IDs in `mentioned_nodes_ids`.
+            Backends can override this to count without fetching the IDs.
+        """
         return len(self.mentioned_nodes_ids)
 
     def number_of_edges(self, u=None, v=None, key=None) -> int:
         return self.reduce_edges(u, v, key).count
 
+    def count_edges(self) -> int:
+        """
+            Same as `self.number_of_edges()`, but the result is cached
+            until the graph is modified through one of the `invalidates_caches` methods.
+        """
+        if self._n_edges_cache is None:
+            self._n_edges_cache = self.number_of_edges()
+        return self._n_edges_cache
+
+    def count_related(self, v) -> int:
+        """
+            Cached number of edges containing `v` in any role.
+        """
+        return self._count_related_cached(v)
+
+    def _count_related(self, v) -> int:
+        return self.number_of_edges(v, v)
+
+    def count_followers_many(self, vs: Sequence[int]) -> Sequence[int]:
+        """
+            Batched version of `number_of_edges(None, v)`.
+            Returns the number of edges ending in every member of `vs` in the same order.
+        """
+        return [self.number_of_edges(None, v) for v in vs]
+
+    def count_following_many(self, vs: Sequence[int]) -> Sequence[int]:
+        """
+            Batched version of `number_of_edges(v, None)`.
+            Returns the number of edges starting in every member of `vs` in the same order.
+        """
+        return [self.number_of_edges(v, None) for v in vs]
+
     def __len__(self) -> int:
         """
             Uses `self.number_of_nodes()`.
@@ -122,6 +193,15 @@ class BaseAPI(object):
         """
         return [e.inverted() for e in self.out_edges]
 
+    def iterate_edge_chunks(self, chunk_len=65536) -> Generator[List[Tuple[int, int, float]], None, None]:
+        """
+            Streams all the edges as lists of `(first, second, weight)` tuples.
+            Backends can override this to avoid constructing `Edge` objects
+            and materializing the whole graph at once.
+        """
+        for es in chunks(self.edges, chunk_len):
+            yield [(e.first, e.second, e.weight) for e in es]
+
     @property
     @abstractmethod
     def mentioned_nodes_ids(self) -> Sequence[int]:
@@ -148,13 +228,32 @@ class BaseAPI(object):
         """
         return None
 
+    def edges_from(self, v) -> Sequence[Edge]:
+        """
+            Same as `self.has_edge(v, None)`, but backends can implement it
+            with a fixed query, instead of branching on missing arguments.
+        """
+        return self.has_edge(v, None)
+
+    def edges_to(self, v) -> Sequence[Edge]:
+        """
+            Same as `self.has_edge(None, v)`, specialized like `edges_from`.
+        """
+        return self.has_edge(None, v)
+
+    def edges_related(self, v) -> Sequence[Edge]:
+        """
+            Same as `self.has_edge(v, v)`, specialized like `edges_from`.
+        """
+        return self.has_edge(v, v)
+
     @abstractmethod
     def neighbors(self, n) -> Sequence[int]:
         """
             Returns IDs of nodes that have a shared edge with `v`.
             https://networkx.github.io/documentation/stable/reference/classes/generated/networkx.MultiDiGraph.neighbors.html
         """
-        result = self.unique_members_of_edges(self.has_edge(n, n))
+        result = self.unique_members_of_edges(self.edges_related(n))
         result.discard(n)
         return result
 
@@ -163,7 +262,7 @@ class BaseAPI(object):
         """
             https://networkx.github.io/documentation/stable/reference/classes/generated/networkx.MultiDiGraph.successors.html
         """
-        result = self.unique_members_of_edges(self.has_edge(n, None))
+        result = self.unique_members_of_edges(self.edges_from(n))
         result.discard(n)
         return result
 
@@ -172,7 +271,7 @@ class BaseAPI(object):
         """
             https://networkx.github.io/documentation/stable/reference/classes/generated/networkx.MultiDiGraph.predecessors.html
         """
-        result = self.unique_members_of_edges(self.has_edge(None, n))
+        result = self.unique_members_of_edges(self.edges_to(n))
         result.discard(n)
         return result
 
@@ -197,27 +296,81 @@ class BaseAPI(object):
             **e.payload,
         )
 
+    def has_edges(self, pairs: Sequence[Tuple[int, int]]) -> Sequence[Sequence[Edge]]:
+        """
+            Batched version of `has_edge`, that can be served in a single round-trip.
+            Returns a list of matching edges for every `(u, v)` pair in the same order.
+        """
+        return [self.has_edge(u, v) for u, v in pairs]
+
+    def count_matching_pairs(self, pairs: Sequence[Tuple[int, int]]) -> int:
+        """
+            Counts how many of the `(u, v)` pairs are connected by at least one edge.
+            Backends can evaluate the whole batch on the server, returning just the number.
+        """
+        return sum(1 for es in self.has_edges(pairs) if len(es) > 0)
+
+    def neighbors_many(self, vs: Sequence[int]) -> Sequence[Set[int]]:
+        """
+            Batched version of `neighbors`.
+            Returns a set of related node IDs for every member of `vs` in the same order.
+        """
+        return [self.neighbors(v) for v in vs]
+
+    def neighbors_many_cached(self, vs: Sequence[int]) -> Sequence[FrozenSet[int]]:
+        """
+            Same as `neighbors_many`, but the results are memoized in a `SegmentedCache`
+            until the graph is modified through one of the `invalidates_caches` methods.
+            All the missing entries are fetched in a single batch.
+        """
+        cache = self._neighbors_cache
+        found = dict()
+        with self._neighbors_lock:
+            generation = self._neighbors_generation
+            for v in set(vs):
+                related = cache.get(v)
+                if related is not None:
+                    found[v] = related
+        missing = [v for v in set(vs) if v not in found]
+        if len(missing) > 0:
+            fetched = {v: frozenset(related) for v, related in zip(
+                missing, self.neighbors_many(missing))}
+            found.update(fetched)
+            with self._neighbors_lock:
+                # Results fetched before a concurrent write may be stale.
+                if generation == self._neighbors_generation:
+                    for v, related in fetched.items():
+                        cache.put(v, related)
+        return [found[v] for v in vs]
+
     @abstractmethod
     def neighbors_of_group(self, vs: Sequence[int]) -> Set[int]:
         """Returns IDs of nodes that have one or more edges with members of `vs`."""
         results = set()
-        for v in vs:
-            results = results.union(self.neighbors(v))
-        return results.difference(set(vs))
+        for related in self.neighbors_many(vs):
+            results.update(related)
+        results.difference_update(vs)
+        return results
 
     @abstractmethod
     def neighbors_of_neighbors(self, v: int, include_related=False) -> Set[int]:
-        related = self.neighbors(v)
-        related_to_related = self.neighbors_of_group(related.union({v}))
+        related, = self.neighbors_many_cached([v])
+        related_to_related = set()
+        for vs_related in self.neighbors_many_cached(list(related)):
+            related_to_related.update(vs_related)
+        # Updating in-place avoids copying the potentially huge set.
         if include_related:
-            return related_to_related.union(related).difference({v})
+            related_to_related.update(related)
         else:
-            return related_to_related.difference(related).difference({v})
+            related_to_related.difference_update(related)
+        related_to_related.discard(v)
+        return related_to_related
 
 
 # region Random Writes
 
     @abstractmethod
+    @invalidates_caches
     def add(self, obj, upsert=True) -> int:
         """
             Adds either an `Edge`, `Sequence[Edge]`, `Node` or `Sequence[Node]`.
@@ -229,6 +382,7 @@ class BaseAPI(object):
             return 0
 
     @abstractmethod
+    @invalidates_caches
     def remove(self, obj) -> int:
         """
             Removes either an `Edge`, `Sequence[Edge]`, `Node` or `Sequence[Node]`.
@@ -240,12 +394,19 @@ class BaseAPI(object):
         else:
             return 0
 
+    @invalidates_caches
     def remove_node(self, n) -> int:
         """
             Removes all the edges containing that node.
+            The edges are fetched once and passed to `remove` as a single sequence.
+            The default `remove` deletes them one by one, so backends are
+            encouraged to batch sequences there or override this method.
             https://networkx.github.io/documentation/stable/reference/classes/generated/networkx.Graph.remove.html
         """
-        return self.remove(self.edges_related(n))
+        es = self.edges_related(n)
+        if len(es) == 0:
+            return 0
+        return self.remove(list(es))
 
     def add_node(self, _id, **attrs) -> bool:
         """
@@ -273,20 +434,60 @@ class BaseAPI(object):
 # region Bulk
 
     @abstractmethod
+    @invalidates_caches
     def add_stream(self, stream, upsert=True) -> int:
         """
             Imports data from adjacency list CSV file. Row shape: `(first, second, weight)`.
             Uses the `biggest_edge_id` to generate incremental IDs for new edges.
             Doesn't guarantee edge uniqness (for 2 given nodes) as `upsert_bulk` does.
+            Every chunk is sorted by members before being passed to the backend.
         """
         count_edges_added = 0
         chunk_len = type(self).__max_batch_size__
         for es in chunks(stream, chunk_len):
+            es = sort_edges_by_members(es)
             count_edges_added += self.add(es, upsert=upsert)
         self.add_missing_nodes()
         return count_edges_added
 
+    @invalidates_caches
+    def add_stream_parallel(self, stream, upsert=True, thread_count=8) -> int:
+        """
+            Same as `add_stream`, but submits chunks to a pool of threads.
+            The number of chunks in flight is bounded, so the `stream`
+            is never fully materialized. Exceptions from workers are re-raised.
+            Backends that aren't `__is_concurrent__` import sequentially,
+            just like calls within an open `transaction`, which workers can't join.
+        """
+        if not type(self).__is_concurrent__ or thread_count <= 1 or self.in_transaction():
+            return self.add_stream(stream, upsert=upsert)
+
+        count_edges_added = self.map_chunks_parallel(
+            stream, lambda es: self.add(es, upsert=upsert), thread_count)
+        self.add_missing_nodes()
+        return count_edges_added
+
+    def map_chunks_parallel(self, stream, insert_chunk, thread_count: int) -> int:
+        """
+            Passes sorted chunks of the `stream` to `insert_chunk` from a pool of threads
+            and sums the returned counts. At most `2 * thread_count` chunks are in flight.
+        """
+        count_edges_added = 0
+        chunk_len = type(self).__max_batch_size__
+        pending = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as executor:
+            for es in chunks(stream, chunk_len):
+                if len(pending) >= thread_count * 2:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    count_edges_added += sum(f.result() for f in done)
+                es = sort_edges_by_members(es)
+                pending.add(executor.submit(insert_chunk, es))
+            count_edges_added += sum(f.result() for f in pending)
+        return count_edges_added
+
     @abstractmethod
+    @invalidates_caches
     def clear(self):
         """
             Remove all nodes and edges from the graph.
@@ -295,6 +496,7 @@ class BaseAPI(object):
         pass
 
     @abstractmethod
+    @invalidates_caches
     def clear_edges(self):
         """
             Remove all edges from the graph, but keep the nodes.
@@ -359,9 +561,73 @@ class BaseAPI(object):
         e.payload = dict(key=key, **attrs)
         return e
 
+    @contextmanager
+    def transaction(self):
+        """
+            Groups all the operations issued within the `with` block
+            into a single transaction, if the backend supports it.
+            This way commits (and `fsync`s) are amortized across many writes.
+        """
+        yield self
+
+    def in_transaction(self) -> bool:
+        """
+            Checks, if the current thread has an open `transaction`.
+        """
+        return False
+
+    def invalidate_caches(self):
+        # Subclasses, that don't call `BaseAPI.__init__`, have no caches to drop.
+        self._n_edges_cache = None
+        count_related_cached = getattr(self, '_count_related_cached', None)
+        if count_related_cached is not None:
+            count_related_cached.cache_clear()
+        neighbors_lock = getattr(self, '_neighbors_lock', None)
+        if neighbors_lock is not None:
+            with neighbors_lock:
+                self._neighbors_generation += 1
+                self._neighbors_cache.clear()
+
     def unique_members_of_edges(self, es: Sequence[Edge]) -> Set[int]:
         result = set()
         for e in es:
             result.add(e.first)
             result.add(e.second)
         return result
+
+    def is_batchable_pair(self, u, v) -> bool:
+        """
+            Batched lookups are only implemented for edges with two
+            distinct and known members. Other combinations of `has_edge`
+            arguments fall back to the one-by-one version.
+        """
+        u = self.make_node_id(u)
+        v = self.make_node_id(v)
+        return u >= 0 and v >= 0 and u != v
+
+    def group_edges_by_pairs(self, pairs: Sequence[Tuple[int, int]], es: Sequence[Edge]) -> Sequence[Sequence[Edge]]:
+        """
+            Distributes the results of a batched query between the requested `pairs`.
+            In undirected graphs every edge matches both `(u, v)` and `(v, u)`.
+        """
+        es_by_members = collections.defaultdict(list)
+        for e in es:
+            es_by_members[(e.first, e.second)].append(e)
+            if not self.directed:
+                es_by_members[(e.second, e.first)].append(e)
+        return [es_by_members.get((self.make_node_id(u), self.make_node_id(v)), [])
+                for u, v in pairs]
+
+    def group_neighbors(self, vs: Sequence[int], es: Sequence[Edge]) -> Sequence[Set[int]]:
+        """
+            Distributes the results of a batched query between the requested nodes `vs`.
+        """
+        related = {v: set() for v in vs}
+        for e in es:
+            if e.first in related:
+                related[e.first].add(e.second)
+            if e.second in related:
+                related[e.second].add(e.first)
+        for v, vs_related in related.items():
+            vs_related.discard(v)
+        return [related[v] for v in vs]
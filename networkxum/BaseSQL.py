@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from contextlib import contextmanager
 import json
+import threading
 
 import sqlalchemy as sa
 from sqlalchemy.orm import sessionmaker
@@ -51,8 +52,15 @@ class EdgeSQL(DeclarativeSQL, Edge):
         Edge.__init__(self, *args, **kwargs)
 
 
-index_first = Index('index_first', EdgeSQL.first, unique=False)
-index_second = Index('index_second', EdgeSQL.second, unique=False)
+# Lookups by both members are served by a single seek in either direction,
+# while the leading columns still cover lookups by just one member.
+# PostgreSQL can also answer the weighted degree queries from the index alone.
+index_first_second = Index(
+    'index_first_second', EdgeSQL.first, EdgeSQL.second,
+    unique=False, postgresql_include=['weight'])
+index_second_first = Index(
+    'index_second_first', EdgeSQL.second, EdgeSQL.first,
+    unique=False, postgresql_include=['weight'])
 index_label = Index('index_label', EdgeSQL.label, unique=False)
 index_directed = Index('index_directed', EdgeSQL.is_directed, unique=False)
 
@@ -117,15 +125,21 @@ class BaseSQL(BaseAPI):
     __max_batch_size__ = 1000000
     __edge_type__ = EdgeSQL
     __in_memory__ = False
+    # Every operand adds a level to the `OR` expression tree,
+    # and SQLite rejects trees deeper than 1000.
+    __max_or_operands_per_query__ = 500
 
     def __init__(self, url='sqlite:///:memory:', **kwargs):
         BaseAPI.__init__(self, **kwargs)
         # https://stackoverflow.com/a/51184173
         if not database_exists(url):
             create_database(url)
-        self.engine = sa.create_engine(url)
+        self.engine_url_dialect = sa.engine.url.make_url(url).get_backend_name()
+        self.engine = sa.create_engine(url, **self.engine_options())
         DeclarativeSQL.metadata.create_all(self.engine)
         self.session_maker = sessionmaker(bind=self.engine)
+        # Set only inside of `self.transaction()` and only for the thread that opened it.
+        self._local = threading.local()
 
 # region Metadata
 
@@ -134,35 +148,48 @@ class BaseSQL(BaseAPI):
         with self.get_session() as s:
             result = s.query(
                 func.count(NodeSQL.weight).label("count"),
-                func.sum(NodeSQL.weight).label("sum"),
-            ).first()
+                func.coalesce(func.sum(NodeSQL.weight), 0).label("sum"),
+            ).one()
 
-        return GraphDegree(*result)
+        return GraphDegree(int(result[0]), float(result[1]))
 
     def reduce_edges(self, u=None, v=None, key=None) -> GraphDegree:
         result = (0, 0)
         with self.get_session() as s:
+            # `SUM` of no rows is `NULL`, not zero.
             q = s.query(
                 func.count(EdgeSQL.weight).label("count"),
-                func.sum(EdgeSQL.weight).label("sum"),
+                func.coalesce(func.sum(EdgeSQL.weight), 0).label("sum"),
             )
             q = self.filter_edges_members(q, u, v)
             q = self.filter_edges_label(q, key)
-            result = q.first()
+            result = q.one()
 
-        return GraphDegree(*result)
+        return GraphDegree(int(result[0]), float(result[1]))
+
+    def number_of_edges(self, u=None, v=None, key=None) -> int:
+        # Unlike `reduce_edges`, doesn't aggregate the weights.
+        with self.get_session() as s:
+            q = s.query(func.count(EdgeSQL._id))
+            q = self.filter_edges_members(q, u, v)
+            q = self.filter_edges_label(q, key)
+            return q.scalar()
+        return 0
+
+    def count_followers_many(self, vs: Sequence[int]) -> Sequence[int]:
+        if not self.directed:
+            return super().count_followers_many(vs)
+        return self.count_grouped_by(EdgeSQL.second, vs)
+
+    def count_following_many(self, vs: Sequence[int]) -> Sequence[int]:
+        if not self.directed:
+            return super().count_following_many(vs)
+        return self.count_grouped_by(EdgeSQL.first, vs)
 
     def biggest_edge_id(self) -> int:
-        result = 0
         with self.get_session() as s:
-            biggest = s.query(
-                func.max(EdgeSQL._id).label("max"),
-            ).first()
-            if biggest[0] is None:
-                result = 0
-            else:
-                result = biggest[0]
-        return result
+            return s.query(func.coalesce(func.max(EdgeSQL._id), 0)).scalar()
+        return 0
 
 # region Bulk Reads
 
@@ -184,14 +211,23 @@ class BaseSQL(BaseAPI):
             return s.query(EdgeSQL).filter(EdgeSQL.is_directed == True).all()
         return []
 
+    def iterate_edge_chunks(self, chunk_len=65536) -> Generator[List[Tuple[int, int, float]], None, None]:
+        with self.get_session() as s:
+            q = s.query(EdgeSQL.first, EdgeSQL.second, EdgeSQL.weight)
+            for rows in chunks(q.yield_per(chunk_len), chunk_len):
+                yield [tuple(row) for row in rows]
+
     @property
     def mentioned_nodes_ids(self) -> Sequence[int]:
         with self.get_session() as s:
-            all_froms = s.query(EdgeSQL.first).distinct().all()
-            all_tos = s.query(EdgeSQL.second).distinct().all()
-            result = set(all_froms).union(all_tos)
-            return result
-        return []
+            return {v for v, in self.query_mentioned_nodes_ids(s)}
+        return set()
+
+    def count_mentioned_nodes(self) -> int:
+        with self.get_session() as s:
+            ids = self.query_mentioned_nodes_ids(s).subquery()
+            return s.query(func.count()).select_from(ids).scalar()
+        return 0
 
 # region Random Reads
 
@@ -209,22 +245,103 @@ class BaseSQL(BaseAPI):
             return q.all()
         return []
 
-    def neighbors_of_group(self, vs: Sequence[int]) -> Set[int]:
-        result = set()
+    def edges_from(self, v) -> Sequence[Edge]:
+        if not self.directed:
+            return self.edges_related(v)
+        v = self.make_node_id(v)
+        with self.get_session() as s:
+            return s.query(EdgeSQL).filter(EdgeSQL.first == v).all()
+        return []
+
+    def edges_to(self, v) -> Sequence[Edge]:
+        if not self.directed:
+            return self.edges_related(v)
+        v = self.make_node_id(v)
         with self.get_session() as s:
-            edges = s.query(EdgeSQL).filter(or_(
+            return s.query(EdgeSQL).filter(EdgeSQL.second == v).all()
+        return []
+
+    def edges_related(self, v) -> Sequence[Edge]:
+        v = self.make_node_id(v)
+        with self.get_session() as s:
+            return self.filter_edges_containing(s.query(EdgeSQL), v).all()
+        return []
+
+    def has_edges(self, pairs: Sequence[Tuple[int, int]]) -> Sequence[Sequence[Edge]]:
+        pairs = list(pairs)
+        if not all(self.is_batchable_pair(u, v) for u, v in pairs):
+            return super().has_edges(pairs)
+        if len(pairs) == 0:
+            return []
+        es = list()
+        with self.get_session() as s:
+            for pairs_part in chunks(pairs, self.count_pairs_per_query()):
+                es.extend(s.query(EdgeSQL).filter(or_(*[
+                    self.match_edges_members(u, v) for u, v in pairs_part
+                ])).all())
+        return self.group_edges_by_pairs(pairs, es)
+
+    def count_matching_pairs(self, pairs: Sequence[Tuple[int, int]]) -> int:
+        pairs = list(pairs)
+        # In undirected graphs the same edge can match two different pairs.
+        if not self.directed or not all(self.is_batchable_pair(u, v) for u, v in pairs):
+            return super().count_matching_pairs(pairs)
+        if len(pairs) == 0:
+            return 0
+        found = set()
+        with self.get_session() as s:
+            for pairs_part in chunks(pairs, self.count_pairs_per_query()):
+                # Only the distinct matched pairs travel back, not the edges.
+                found.update(s.query(EdgeSQL.first, EdgeSQL.second).filter(or_(*[
+                    self.match_edges_members(u, v) for u, v in pairs_part
+                ])).distinct().all())
+        return sum(1 for u, v in pairs if (self.make_node_id(u), self.make_node_id(v)) in found)
+
+    def neighbors_many(self, vs: Sequence[int]) -> Sequence[Set[int]]:
+        vs = [self.make_node_id(v) for v in vs]
+        if len(vs) == 0:
+            return []
+        with self.get_session() as s:
+            # Rows of IDs expose `first` and `second` just like `Edge`s.
+            es = s.query(EdgeSQL.first, EdgeSQL.second).filter(or_(
                 EdgeSQL.first.in_(vs),
                 EdgeSQL.second.in_(vs),
             )).all()
-            for e in edges:
-                if (e.first not in vs):
-                    result.add(e.first)
-                elif (e.second not in vs):
-                    result.add(e.second)
-        return result
+            return self.group_neighbors(vs, es)
+        return []
+
+    def neighbors(self, n) -> Set[int]:
+        n = self.make_node_id(n)
+        with self.get_session() as s:
+            members = self.filter_edges_containing(
+                s.query(EdgeSQL.first, EdgeSQL.second), n).all()
+            result = {first for first, _ in members}
+            result.update(second for _, second in members)
+            result.discard(n)
+            return result
+        return set()
+
+    def neighbors_of_group(self, vs: Sequence[int]) -> Set[int]:
+        vs = list({self.make_node_id(v) for v in vs})
+        if len(vs) == 0:
+            return set()
+        with self.get_session() as s:
+            # The DB excludes the group members and deduplicates the rest,
+            # so only the IDs of distinct outside neighbors travel back.
+            successors = s.query(EdgeSQL.second).filter(
+                EdgeSQL.first.in_(vs),
+                EdgeSQL.second.notin_(vs),
+            )
+            predecessors = s.query(EdgeSQL.first).filter(
+                EdgeSQL.second.in_(vs),
+                EdgeSQL.first.notin_(vs),
+            )
+            return {v for v, in successors.union(predecessors)}
+        return set()
 
 # region Random Writes
 
+    @invalidates_caches
     def add(self, obj, upsert=True) -> int:
         if isinstance(obj, DeclarativeSQL):
             with self.get_session() as s:
@@ -238,15 +355,33 @@ class BaseSQL(BaseAPI):
         all_ids = [o._id for o in obj]
         new_dicts = {o._id: o.__dict__ for o in obj}
         target_class = EdgeSQL if is_sequence_of(obj, Edge) else NodeSQL
+        # Both upsert paths return the number of inserted or updated rows.
         with self.get_session() as s:
-            # Only merge those entries which already exist in the database
+            # Columns missing in the objects must keep their stored values,
+            # so rows are grouped by the set of columns they provide.
+            all_columns = target_class.__table__.columns.keys()
+            rows_by_columns = collections.defaultdict(list)
+            for d in new_dicts.values():
+                row = {c: d[c] for c in all_columns if c in d}
+                rows_by_columns[tuple(row.keys())].append(row)
+            upsert_statements = {
+                columns: self.upsert_statement(target_class, columns)
+                for columns in rows_by_columns
+            } if upsert else dict()
+            if len(upsert_statements) and None not in upsert_statements.values():
+                # A single round-trip per group, that the DB resolves atomically.
+                for columns, rows in rows_by_columns.items():
+                    s.execute(upsert_statements[columns], rows)
+                return len(new_dicts)
+            # Only update those entries which already exist in the database.
+            # Plain mappings skip the unit-of-work bookkeeping of ORM objects.
+            count_updated = 0
             if upsert:
-                for each in s.query(target_class).filter(target_class._id.in_(all_ids)).all():
-                    new_dict = new_dicts.pop(each._id)
-                    for k, v in new_dict.items():
-                        if k is not '_id':
-                            setattr(each, k, v)
-                    s.merge(each)
+                existing_ids = s.query(target_class._id).filter(
+                    target_class._id.in_(all_ids))
+                existing_dicts = [new_dicts.pop(_id) for _id, in existing_ids.all()]
+                s.bulk_update_mappings(target_class, existing_dicts)
+                count_updated = len(existing_dicts)
             # Only add those posts which did not exist in the database
             s.bulk_insert_mappings(
                 target_class,
@@ -254,11 +389,24 @@ class BaseSQL(BaseAPI):
                 return_defaults=False,
                 render_nulls=True,
             )
-            return len(new_dicts)
+            return count_updated + len(new_dicts)
 
         return super().add(obj)
 
+    @invalidates_caches
     def remove(self, obj) -> int:
+        # Edges with known IDs are deleted in a single query.
+        if is_sequence_of(obj, Edge):
+            known_ids = [e._id for e in obj if e._id >= 0]
+            unknown_edges = [e for e in obj if e._id < 0]
+            count_removed = 0
+            if len(known_ids):
+                with self.get_session() as s:
+                    count_removed = s.query(EdgeSQL).filter(
+                        EdgeSQL._id.in_(known_ids)
+                    ).delete(synchronize_session=False)
+            return count_removed + sum(map(self.remove, unknown_edges))
+
         with self.get_session() as s:
             # Edge
             if isinstance(obj, Edge):
@@ -283,11 +431,13 @@ class BaseSQL(BaseAPI):
 
         return super().remove(obj)
 
+    @invalidates_caches
     def remove_node(self, n) -> int:
         return self.remove(self.make_node(n))
 
 # region Bulk Writes
 
+    @invalidates_caches
     def clear_edges(self) -> int:
         result = 0
         with self.get_session() as s:
@@ -295,6 +445,7 @@ class BaseSQL(BaseAPI):
             result += s.query(EdgeNewSQL).delete()
         return result
 
+    @invalidates_caches
     def clear(self) -> int:
         result = 0
         with self.get_session() as s:
@@ -303,6 +454,7 @@ class BaseSQL(BaseAPI):
             result += s.query(EdgeNewSQL).delete()
         return result
 
+    @invalidates_caches
     def add_stream(self, stream, upsert=True) -> int:
         if upsert:
             return super().add_stream(stream, upsert=True)
@@ -311,6 +463,7 @@ class BaseSQL(BaseAPI):
             # Build the new table.
             chunk_len = type(self).__max_batch_size__
             for objs in chunks(stream, chunk_len):
+                objs = sort_edges_by_members(objs)
                 s.bulk_insert_mappings(
                     EdgeNewSQL,
                     [o.__dict__ for o in objs],
@@ -326,6 +479,33 @@ class BaseSQL(BaseAPI):
         result = self.number_of_edges() - cnt
         return result
 
+    @invalidates_caches
+    def add_from_csv(self, filepath: str, is_directed=True) -> int:
+        """
+            Parses the adjacency list CSV file in big chunks and bulk-inserts
+            plain dicts without ever constructing `Edge` objects.
+            Just like `add_stream` with `upsert=False`, doesn't guarantee edge uniqness:
+            the rows are appended under IDs following the `biggest_edge_id`,
+            rather than upserted.
+        """
+        current_id = self.biggest_edge_id() + 1
+        with self.get_session() as s:
+            chunk_len = type(self).__max_batch_size__
+            for rows in yield_edge_dicts_from_csv(filepath, chunk_len, is_directed=is_directed, id_offset=current_id):
+                s.bulk_insert_mappings(
+                    EdgeNewSQL,
+                    rows,
+                    return_defaults=False,
+                    render_nulls=True,
+                )
+
+        cnt = self.number_of_edges()
+        self.insert_table(EdgeNewSQL.__tablename__)
+        self.clear_table(EdgeNewSQL.__tablename__)
+        self.add_missing_nodes()
+        result = self.number_of_edges() - cnt
+        return result
+
 # region Helpers
 
     def insert_table(self, source_name: str):
@@ -354,12 +534,71 @@ class BaseSQL(BaseAPI):
             ''')
             s.execute(migration)
 
+    def count_pairs_per_query(self) -> int:
+        # In undirected graphs `match_edges_members` adds two operands per pair.
+        operands_per_pair = 1 if self.directed else 2
+        return type(self).__max_or_operands_per_query__ // operands_per_pair
+
+    def engine_options(self) -> dict:
+        """
+            Keyword arguments for `create_engine`.
+            Dialects extend them with pool sizes and batching modes.
+        """
+        # Stale pooled connections are replaced instead of failing the query.
+        options = {'pool_pre_ping': True}
+        # SQLite engines don't use a `QueuePool`, so they can't be sized.
+        if self.engine_url_dialect != 'sqlite':
+            # Enough connections for the concurrent benchmarks.
+            options['pool_size'] = 32
+            options['max_overflow'] = 32
+        return options
+
+    def upsert_statement(self, target_class, columns: Sequence[str]):
+        """
+            Dialect-specific `INSERT` of the `columns`, that overwrites
+            those columns (and only those) in rows with the same `_id`.
+            Returns `None`, if the dialect has no native upsert.
+            Then `add` has to `SELECT` the existing rows and merge them.
+        """
+        return None
+
     def clear_table(self, table_name: str):
         with self.get_session() as s:
             s.execute(text(f'DELETE FROM {table_name};'))
 
+    @contextmanager
+    def transaction(self):
+        if self._shared_session is not None:
+            yield self
+            return
+        try:
+            with self.get_session() as s:
+                self._shared_session = s
+                try:
+                    yield self
+                finally:
+                    self._shared_session = None
+        finally:
+            # Caches may hold rows, that were read before a rollback.
+            self.invalidate_caches()
+
+    def in_transaction(self) -> bool:
+        return self._shared_session is not None
+
+    @property
+    def _shared_session(self):
+        return getattr(self._local, 'session', None)
+
+    @_shared_session.setter
+    def _shared_session(self, session):
+        self._local.session = session
+
     @contextmanager
     def get_session(self):
+        # Within a transaction, the changes are only committed on exit.
+        if self._shared_session is not None:
+            yield self._shared_session
+            return
         session = self.session_maker()
         session.expire_on_commit = False
         try:
@@ -372,6 +611,25 @@ class BaseSQL(BaseAPI):
         finally:
             session.close()
 
+    def count_grouped_by(self, column, vs: Sequence[int]) -> Sequence[int]:
+        """
+            Counts edges for every member of `vs` with a single `GROUP BY` query.
+        """
+        vs = [self.make_node_id(v) for v in vs]
+        if len(vs) == 0:
+            return []
+        with self.get_session() as s:
+            counts = dict(s.query(
+                column,
+                func.count(EdgeSQL._id),
+            ).filter(column.in_(vs)).group_by(column).all())
+            return [counts.get(v, 0) for v in vs]
+        return []
+
+    def query_mentioned_nodes_ids(self, s):
+        # `UNION` deduplicates inside the DB, unlike two `DISTINCT` scans.
+        return s.query(EdgeSQL.first).union(s.query(EdgeSQL.second))
+
     def filter_edges_containing(self, q, n):
         return q.filter(or_(
             EdgeSQL.first == n,
@@ -391,28 +649,34 @@ class BaseSQL(BaseAPI):
             elif v < 0:
                 return q.filter(EdgeSQL.first == u)
         else:
-            if self.directed:
-                if u == v:
-                    return self.filter_edges_containing(q, u)
-                else:
-                    return q.filter(and_(
-                        EdgeSQL.first == u,
-                        EdgeSQL.second == v,
-                    ))
+            if u == v:
+                return self.filter_edges_containing(q, u)
             else:
-                if u == v:
-                    return self.filter_edges_containing(q, u)
-                else:
-                    return q.filter(or_(
-                        and_(
-                            EdgeSQL.first == v,
-                            EdgeSQL.second == u,
-                        ),
-                        and_(
-                            EdgeSQL.first == u,
-                            EdgeSQL.second == v,
-                        )
-                    ))
+                return q.filter(self.match_edges_members(u, v))
+
+    def match_edges_members(self, u, v):
+        """
+            Condition for edges connecting two distinct known nodes.
+            Can be combined with others to batch lookups into one query.
+        """
+        u = self.make_node_id(u)
+        v = self.make_node_id(v)
+        if self.directed:
+            return and_(
+                EdgeSQL.first == u,
+                EdgeSQL.second == v,
+            )
+        else:
+            return or_(
+                and_(
+                    EdgeSQL.first == v,
+                    EdgeSQL.second == u,
+                ),
+                and_(
+                    EdgeSQL.first == u,
+                    EdgeSQL.second == v,
+                )
+            )
 
     def filter_edges_label(self, q, key):
         key = self.make_label(key)
@@ -6,7 +6,7 @@ import pymongo
 from pymongo import MongoClient
 from pymongo import UpdateOne
 
-from PyStorageGraph.BaseAPI import BaseAPI
+from PyStorageGraph.BaseAPI import BaseAPI, invalidates_caches
 from PyStorageHelpers import *
 
 
@@ -54,6 +54,16 @@ class MongoDB(BaseAPI):
             return GraphDegree(0, 0)
         return GraphDegree(result[0]['count'], result[0]['weight'])
 
+    def count_followers_many(self, vs: Sequence[int]) -> Sequence[int]:
+        if not self.directed:
+            return super().count_followers_many(vs)
+        return self.count_grouped_by('second', vs)
+
+    def count_following_many(self, vs: Sequence[int]) -> Sequence[int]:
+        if not self.directed:
+            return super().count_following_many(vs)
+        return self.count_grouped_by('first', vs)
+
     def biggest_edge_id(self) -> int:
         result = self.edges_collection.find(
             {},
@@ -81,6 +91,16 @@ class MongoDB(BaseAPI):
         })
         return [Edge(**as_dict) for as_dict in result]
 
+    def iterate_edge_chunks(self, chunk_len=65536) -> Generator[List[Tuple[int, int, float]], None, None]:
+        result = self.edges_collection.find(projection={
+            '_id': 0,
+            'first': 1,
+            'second': 1,
+            'weight': 1,
+        }, batch_size=chunk_len)
+        for docs in chunks(result, chunk_len):
+            yield [(d['first'], d['second'], d.get('weight', 1)) for d in docs]
+
     @property
     def mentioned_nodes_ids(self) -> Sequence[int]:
         ids = set()
@@ -110,6 +130,72 @@ class MongoDB(BaseAPI):
         ] if step])
         return [Edge(**as_dict) for as_dict in result]
 
+    def edges_from(self, v) -> Sequence[Edge]:
+        if not self.directed:
+            return self.edges_related(v)
+        result = self.edges_collection.find(filter={'first': self.make_node_id(v)})
+        return [Edge(**as_dict) for as_dict in result]
+
+    def edges_to(self, v) -> Sequence[Edge]:
+        if not self.directed:
+            return self.edges_related(v)
+        result = self.edges_collection.find(filter={'second': self.make_node_id(v)})
+        return [Edge(**as_dict) for as_dict in result]
+
+    def edges_related(self, v) -> Sequence[Edge]:
+        result = self.edges_collection.find(
+            filter=self.pipe_match_edge_containing(self.make_node_id(v))['$match'])
+        return [Edge(**as_dict) for as_dict in result]
+
+    def has_edges(self, pairs: Sequence[Tuple[int, int]]) -> Sequence[Sequence[Edge]]:
+        pairs = list(pairs)
+        if not all(self.is_batchable_pair(u, v) for u, v in pairs):
+            return super().has_edges(pairs)
+        if len(pairs) == 0:
+            return []
+        result = self.edges_collection.find(filter={
+            '$or': [self.pipe_match_edge_members(u, v)['$match'] for u, v in pairs],
+        })
+        es = [Edge(**as_dict) for as_dict in result]
+        return self.group_edges_by_pairs(pairs, es)
+
+    def neighbors(self, n) -> Set[int]:
+        n = self.make_node_id(n)
+        result = self.edges_collection.find(
+            filter=self.pipe_match_edge_containing(n)['$match'],
+            projection={'_id': 0, 'first': 1, 'second': 1},
+        )
+        related = set()
+        for as_dict in result:
+            related.add(as_dict['first'])
+            related.add(as_dict['second'])
+        related.discard(n)
+        return related
+
+    def neighbors_many(self, vs: Sequence[int]) -> Sequence[Set[int]]:
+        vs = [self.make_node_id(v) for v in vs]
+        if len(vs) == 0:
+            return []
+        result = self.edges_collection.find(filter={
+            '$or': [{
+                'first': {'$in': vs},
+            }, {
+                'second': {'$in': vs},
+            }],
+        }, projection={'_id': 0, 'first': 1, 'second': 1})
+        # Group the raw documents without building `Edge` objects.
+        related = {v: set() for v in vs}
+        for as_dict in result:
+            first = as_dict['first']
+            second = as_dict['second']
+            if first in related:
+                related[first].add(second)
+            if second in related:
+                related[second].add(first)
+        for v, vs_related in related.items():
+            vs_related.discard(v)
+        return [related[v] for v in vs]
+
     def neighbors_of_group(self, vs: Sequence[int]) -> Set[int]:
         vs_set = set(vs)
         vs = list(vs_set)
@@ -129,6 +215,7 @@ class MongoDB(BaseAPI):
 
 # region Random Writes
 
+    @invalidates_caches
     def add(self, obj, upsert=True) -> int:
         is_edge = isinstance(obj, Edge)
         is_node = isinstance(obj, Node)
@@ -175,6 +262,7 @@ class MongoDB(BaseAPI):
 
         return super().add(obj, upsert=upsert)
 
+    @invalidates_caches
     def remove(self, obj) -> int:
         is_edge = isinstance(obj, Edge)
         is_node = isinstance(obj, Node)
@@ -197,21 +285,25 @@ class MongoDB(BaseAPI):
                 '$in': ids
             }, }).deleted_count
 
+    @invalidates_caches
     def remove_node(self, n) -> int:
         self.remove(self.make_node(n))
+        n = self.make_node_id(n)
         result = self.edges_collection.delete_many(filter={
             '$or': [
-                {'first': v},
-                {'second': v},
+                {'first': n},
+                {'second': n},
             ]
         })
         return result.deleted_count
 
 # region Bulk Writes
 
+    @invalidates_caches
     def clear_edges(self):
         self.edges_collection.drop()
 
+    @invalidates_caches
     def clear(self):
         self.edges_collection.drop()
         self.nodes_collection.drop()
@@ -226,6 +318,17 @@ class MongoDB(BaseAPI):
         self.edges_collection.create_index(
             'is_directed', background=background, sparse=True)
 
+    def count_grouped_by(self, field: str, vs: Sequence[int]) -> Sequence[int]:
+        vs = [self.make_node_id(v) for v in vs]
+        if len(vs) == 0:
+            return []
+        result = self.edges_collection.aggregate(pipeline=[
+            {'$match': {field: {'$in': vs}}},
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+        ])
+        counts = {r['_id']: r['count'] for r in result}
+        return [counts.get(v, 0) for v in vs]
+
     def pipe_compute_degree(self) -> dict:
         return {
             '$group': {
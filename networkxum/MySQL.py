@@ -1,3 +1,5 @@
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
 from PyStorageGraph.BaseSQL import *
 
 
@@ -43,6 +45,13 @@ class MySQL(BaseSQL):
                 s.execute(p)
                 s.commit()
 
+    def upsert_statement(self, target_class, columns):
+        # https://docs.sqlalchemy.org/en/14/dialects/mysql.html#insert-on-duplicate-key-update-upsert
+        statement = mysql_insert(target_class.__table__)
+        return statement.on_duplicate_key_update({
+            c: statement.inserted[c] for c in columns if c != '_id'
+        })
+
     # def add_from_csv(self, path: str) -> int:
     #     """
     #         This method requires the file to be mounted on the same filesystem.
@@ -1,13 +1,220 @@
+import functools
 import os
-import shutil
-from typing import List, Set, Sequence
+import re
+import threading
+import types
+from contextlib import contextmanager
+from typing import Generator, List, Mapping, Optional, Set, Sequence, Tuple
 from urllib.parse import urlparse
 
-from neo4j import GraphDatabase, Result as Neo4jResult
+from neo4j import GraphDatabase, READ_ACCESS, Result as Neo4jResult
 
 from .helpers.Edge import Edge
-from .BaseAPI import BaseAPI
-from .helpers.Algorithms import chunks, extract_database_name
+from .helpers.GraphDegree import GraphDegree
+from .BaseAPI import BaseAPI, invalidates_caches
+from .helpers.Algorithms import chunks, extract_database_name, sort_edges_by_members
+from .helpers.Parsing import yield_edges_from_csv
+
+# Labels can't contain arbitrary characters of DB names.
+_non_alphanumeric = re.compile(r'[^A-Za-z0-9]')
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_queries(v_label: str, e_label: str) -> Mapping[str, str]:
+    """
+        Substitutes the labels into all the query templates once.
+        The remaining holes are Cypher parameters, so the server
+        can cache the execution plans as well.
+        The result is cached per pair of labels and shared
+        between instances, so it's exposed as a read-only mapping.
+    """
+    templates = {
+        'has_edge_directed': '''
+        MATCH (first:VERTEX {_id: $first})-[e:EDGE]->(second:VERTEX {_id: $second})
+        RETURN first._id, second._id, e.weight
+        ''',
+        'has_edge_undirected': '''
+        MATCH (first:VERTEX {_id: $first})-[e:EDGE]-(second:VERTEX {_id: $second})
+        RETURN first._id, second._id, e.weight
+        ''',
+        'count_matching_pairs_directed': '''
+        UNWIND $pairs AS p
+        WITH p WHERE EXISTS {
+            MATCH (:VERTEX {_id: p[0]})-[:EDGE]->(:VERTEX {_id: p[1]})
+        }
+        RETURN count(p) AS result
+        ''',
+        'count_matching_pairs_undirected': '''
+        UNWIND $pairs AS p
+        WITH p WHERE EXISTS {
+            MATCH (:VERTEX {_id: p[0]})-[:EDGE]-(:VERTEX {_id: p[1]})
+        }
+        RETURN count(p) AS result
+        ''',
+        'edges_from': '''
+        MATCH (first:VERTEX {_id: $v})-[e:EDGE]->(second:VERTEX)
+        RETURN first._id, second._id, e.weight
+        ''',
+        'edges_to': '''
+        MATCH (first:VERTEX)-[e:EDGE]->(second:VERTEX {_id: $v})
+        RETURN first._id, second._id, e.weight
+        ''',
+        'edges_related': '''
+        MATCH (first:VERTEX {_id: $v})-[e:EDGE]-(second:VERTEX)
+        RETURN first._id, second._id, e.weight
+        ''',
+        'edges_related_to_group': '''
+        MATCH (first:VERTEX)-[e:EDGE]-(second:VERTEX)
+        WHERE (first._id IN $vs) AND NOT (second._id IN $vs)
+        RETURN first._id, second._id, e.weight
+        ''',
+        'neighbors_of_group': '''
+        MATCH (first:VERTEX)-[:EDGE]-(second:VERTEX)
+        WHERE (first._id IN $vs) AND NOT (second._id IN $vs)
+        RETURN second._id as _id
+        ''',
+        'neighbors': '''
+        MATCH (:VERTEX {_id: $v})-[:EDGE]-(v_related:VERTEX)
+        RETURN v_related._id as _id
+        ''',
+        'neighbors_of_neighbors_including_related': '''
+        MATCH (v:VERTEX {_id: $v})-[:EDGE]-(:VERTEX)-[:EDGE]-(v_unrelated:VERTEX)
+        WHERE NOT (v._id = v_unrelated._id)
+        RETURN v_unrelated._id as _id
+        ''',
+        'neighbors_of_neighbors': '''
+        MATCH (v:VERTEX {_id: $v})-[:EDGE]-(:VERTEX)-[:EDGE]-(v_unrelated:VERTEX)
+        WHERE NOT EXISTS {
+            MATCH (v)-[e_banned:EDGE]-(v_unrelated)
+        } AND NOT (v._id = v_unrelated._id)
+        RETURN v_unrelated._id as _id
+        ''',
+        'edges': '''
+        MATCH (first:VERTEX)-[e:EDGE]->(second:VERTEX)
+        RETURN first._id, second._id, e.weight
+        ''',
+        'mentioned_nodes_ids': '''
+        MATCH (v:VERTEX)
+        WHERE (v)-[:EDGE]-()
+        RETURN v._id
+        ''',
+        'reduce_nodes': '''
+        MATCH (v:VERTEX)
+        WITH count(v) as result
+        RETURN result
+        ''',
+        'reduce_edges': '''
+        MATCH ()-[e:EDGE]->()
+        WITH count(e) as c, sum(e.weight) as s
+        RETURN c, s
+        ''',
+        'degree_neighbors': '''
+        MATCH (v:VERTEX {_id: $v})-[e:EDGE]-()
+        WITH count(e) as c, sum(e.weight) as s
+        RETURN c, s
+        ''',
+        'degree_predecessors': '''
+        MATCH (:VERTEX)-[e:EDGE]->(v:VERTEX {_id: $v})
+        WITH count(e) as c, sum(e.weight) as s
+        RETURN c, s
+        ''',
+        'degree_successors': '''
+        MATCH (v:VERTEX {_id: $v})-[e:EDGE]->(:VERTEX)
+        WITH count(e) as c, sum(e.weight) as s
+        RETURN c, s
+        ''',
+        'count_followers_many': '''
+        UNWIND $vs AS v
+        OPTIONAL MATCH (:VERTEX)-[e:EDGE]->(:VERTEX {_id: v})
+        RETURN v, count(e) AS c
+        ''',
+        'count_following_many': '''
+        UNWIND $vs AS v
+        OPTIONAL MATCH (:VERTEX {_id: v})-[e:EDGE]->(:VERTEX)
+        RETURN v, count(e) AS c
+        ''',
+        'count_related_many': '''
+        UNWIND $vs AS v
+        OPTIONAL MATCH (:VERTEX {_id: v})-[e:EDGE]-(:VERTEX)
+        RETURN v, count(e) AS c
+        ''',
+        'degrees': '''
+        MATCH (v:VERTEX {_id: $v})
+        OPTIONAL MATCH (v)-[e_out:EDGE]->()
+        WITH v, count(e_out) AS out_count, sum(e_out.weight) AS out_sum
+        OPTIONAL MATCH ()-[e_in:EDGE]->(v)
+        RETURN out_count, out_sum, count(e_in) AS in_count, sum(e_in.weight) AS in_sum
+        ''',
+        'biggest_edge_id': '''
+        MATCH (:VERTEX)-[e:EDGE]->(:VERTEX)
+        RETURN e._id AS _id
+        ORDER BY _id DESC
+        LIMIT 1
+        ''',
+        'shortest_path': '''
+        MATCH (first:VERTEX {_id: $first}), (second:VERTEX {_id: $second})
+        CALL gds.shortestPath.dijkstra.stream($projection, {
+            sourceNode: first,
+            targetNode: second,
+            relationshipWeightProperty: 'weight'
+        })
+        YIELD nodeIds, totalCost
+        RETURN [v IN gds.util.asNodes(nodeIds) | v._id] AS path, totalCost AS weight
+        ''',
+        'project_graph': '''
+        CALL gds.graph.project($projection, 'VERTEX', {
+            EDGE: {orientation: $orientation, properties: 'weight'}
+        })
+        ''',
+        'drop_graph': '''
+        CALL gds.graph.drop($projection, false)
+        ''',
+        'remove_node': '''
+        MATCH (v:VERTEX {_id: $v})
+        DETACH DELETE v
+        ''',
+    }
+    # Cypher can't create relationships without a direction, so undirected
+    # edges are stored as `first->second` with `is_directed: false`,
+    # and only matched regardless of the direction.
+    for d, is_directed, suffix in (('->', 'true', 'directed'), ('-', 'false', 'undirected')):
+        templates['add_' + suffix] = '''
+        MERGE (first:VERTEX {_id: $first})
+        MERGE (second:VERTEX {_id: $second})
+        MERGE (first)-[:EDGE {_id: $_id, weight: $weight, is_directed: %s}]->(second)
+        ''' % is_directed
+        templates['insert_edge_' + suffix] = '''
+        MERGE (first:VERTEX {_id: $first})
+        MERGE (second:VERTEX {_id: $second})
+        CREATE (first)-[:EDGE {_id: $_id, weight: $weight, is_directed: %s}]->(second)
+        ''' % is_directed
+        templates['insert_edges_' + suffix] = '''
+        UNWIND $rows AS row
+        MERGE (first:VERTEX {_id: row.first})
+        MERGE (second:VERTEX {_id: row.second})
+        CREATE (first)-[:EDGE {_id: row._id, weight: row.weight, is_directed: %s}]->(second)
+        ''' % is_directed
+        templates['remove_by_members_' + suffix] = '''
+        MATCH (first:VERTEX {_id: $first})
+        MATCH (second:VERTEX {_id: $second})
+        MATCH (first)-[e:EDGE]%s(second)
+        DELETE e
+        ''' % d
+        # We provide excessive information on node IDs
+        # to use property indexes.
+        templates['remove_by_id_' + suffix] = '''
+        MATCH (first:VERTEX {_id: $first})
+        MATCH (second:VERTEX {_id: $second})
+        MATCH (first)-[e:EDGE {_id: $_id}]%s(second)
+        DELETE e
+        ''' % d
+
+    queries = dict()
+    for name, task in templates.items():
+        task = task.replace('VERTEX', v_label)
+        task = task.replace('EDGE', e_label)
+        queries[name] = task
+    return types.MappingProxyType(queries)
 
 
 class Neo4J(BaseAPI):
@@ -56,7 +263,8 @@ class Neo4J(BaseAPI):
         enterprise_edition=False,
         import_directory='/Users/av/Library/Application Support/Neo4J Desktop/Application/neo4jDatabases/database-b5d1180d-a778-47d2-84e6-4169343543ea/installation-4.0.3/import',
         use_full_name_for_label=False,
-        use_indexes_over_constraints=True,
+        max_connection_pool_size=50,
+        connection_acquisition_timeout=60,
         **kwargs,
     ):
         BaseAPI.__init__(self, **kwargs)
@@ -65,56 +273,46 @@ class Neo4J(BaseAPI):
         # Neo4J can't resolve DB name, username or password on its own.
         url_obj = urlparse(url)
         url_clean = '{x.scheme}://{x.hostname}:{x.port}/'.format(x=url_obj)
+        # Every query borrows a connection from the pool of the driver,
+        # so concurrent callers aren't serialized on a single Bolt stream.
         self.driver = GraphDatabase.driver(
             url_clean,
             auth=(url_obj.username, url_obj.password),
+            max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout,
         )
-        self.session = self.driver.session()
+        # Set only inside of `self.transaction()` and only for the thread that opened it,
+        # so other threads keep using independent pooled sessions.
+        self._local = threading.local()
 
         # Resolve the name (for CAUTION 2):
-        name = str()
-        _, c = extract_database_name(url)
-        if (c in "qwertyuiopasdfghjklzxcvbnm") or\
-            (c in "QWERTYUIOPAFGHJKLZXCVBNM") or\
-                (c in "1234567890"):
-            name += c
+        _, name = extract_database_name(url)
+        name = _non_alphanumeric.sub('', name)
         self._v = 'v' + name
         self._e = 'e' + name
-        # Create constraints if needed.
-        self.use_indexes_over_constraints = use_indexes_over_constraints
-        if use_indexes_over_constraints:
-            idxs = self.get_indexes()
-            if f'index{self._v}' not in idxs:
-                self.create_index_nodes()
-        else:
-            cs = self.get_constraints()
-            if f'constraint{self._v}' not in cs:
-                self.create_constraint_nodes()
-            if f'constraint{self._e}' not in cs:
-                if enterprise_edition:
-                    self.create_constraint_edges()
+        # Instances with the same labels share one dictionary of queries.
+        self._q = _compile_queries(self._v, self._e)
+        # Named in-memory graph for GDS algorithms.
+        self._projection_name = 'projection' + self._v
+        self._projection_is_fresh = False
+        # Every `MATCH` and `MERGE` is keyed by `_id`, so without
+        # the constraint (and its backing index) those are label scans.
+        cs = self.get_constraints()
+        if f'constraint{self._v}' not in cs:
+            # Older versions created a plain index on the same property,
+            # which would conflict with the constraint.
+            if f'index{self._v}' in self.get_indexes():
+                self._run(f'DROP INDEX index{self._v}')
+            self.create_constraint_nodes()
+        if f'constraint{self._e}' not in cs:
+            if enterprise_edition:
+                self.create_constraint_edges()
 
     def get_constraints(self) -> List[str]:
-        cs = list(self.session.run('CALL db.constraints'))
-        names = [c.get('name', '') for c in cs]
-        return names
+        return [c.get('name', '') for c in self._stream('CALL db.constraints')]
 
     def get_indexes(self) -> List[str]:
-        cs = list(self.session.run('CALL db.indexes'))
-        names = [c.get('name', '') for c in cs]
-        return names
-
-    def create_index_nodes(self):
-        # Docs for CYPHER direct syntax:
-        # https://neo4j.com/docs/cypher-manual/current/indexes-for-search-performance/#administration-indexes-syntax
-        task = 'CREATE INDEX indexVERTEX FOR (v:VERTEX) ON (v._id)'
-        # Older version didn't have index names.
-        # Docs for `db.` operations.
-        # https://neo4j.com/docs/operations-manual/current/reference/procedures/#ref-procedure-reference-enterprise-edition
-        # task = 'CALL db.createIndex(":VERTEX(_id)", "native-btree-1.0", )'
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self.session.run(task)
+        return [c.get('name', '') for c in self._stream('CALL db.indexes')]
 
     def create_constraint_nodes(self):
         # Existing uniqueness constraint means,
@@ -127,13 +325,13 @@ class Neo4J(BaseAPI):
         '''
         task = task.replace('VERTEX', self._v)
         task = task.replace('EDGE', self._e)
-        return self.session.run(task)
+        return self._run(task)
 
     def create_constraint_edges(self):
         # Edge uniqness constrains are only availiable to Enterprise Edition customers.
         # https://neo4j.com/docs/cypher-manual/current/administration/constraints/#administration-constraints-syntax
         task = f'''
-        CREATE CONSTRAINT uniqueEDGE
+        CREATE CONSTRAINT constraintEDGE
         ON ()-[e:EDGE]-()
         ASSERT (e._id) IS UNIQUE
         '''
@@ -146,203 +344,149 @@ class Neo4J(BaseAPI):
         # '''
         task = task.replace('VERTEX', self._v)
         task = task.replace('EDGE', self._e)
-        return self.session.run(task)
+        return self._run(task)
+
+    # Bulk reads
+
+    @property
+    def edges(self) -> List[Edge]:
+        return list(self._records_to_edges(self._stream(self._q['edges'])))
+
+    def iterate_edge_chunks(self, chunk_len=65536) -> Generator[List[Tuple[int, int, float]], None, None]:
+        for rs in chunks(self._stream(self._q['edges']), chunk_len):
+            yield [(r[0], r[1], r[2]) for r in rs]
+
+    @property
+    def mentioned_nodes_ids(self) -> Set[int]:
+        return {r[0] for r in self._stream(self._q['mentioned_nodes_ids'])}
 
     # Relatives
 
     def has_edge(self, first: int, second: int, **kwargs) -> List[Edge]:
-        if self.directed:
-            pattern = '''
-            MATCH (first:VERTEX {_id: %d})-[e:EDGE]->(second:VERTEX {_id: %d})
-            RETURN first._id, second._id, e.weight
-            '''
-        else:
-            pattern = '''
-            MATCH (first:VERTEX {_id: %d})-[e:EDGE]-(second:VERTEX {_id: %d})
-            RETURN first._id, second._id, e.weight
-            '''
-        task = pattern % (first, second)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self._records_to_edges(self.session.run(task))
+        task = self._q['has_edge_directed' if self.directed else 'has_edge_undirected']
+        return list(self._records_to_edges(self._stream(task, first=first, second=second)))
+
+    def count_matching_pairs(self, pairs: Sequence[Tuple[int, int]]) -> int:
+        """
+            Ships all the pairs at once and only receives the final count.
+        """
+        task = self._q['count_matching_pairs_directed' if self.directed else 'count_matching_pairs_undirected']
+        pairs = [[int(u), int(v)] for u, v in pairs]
+        return int(self._first_record(self._read(task, pairs=pairs), 'result') or 0)
 
     def edges_from(self, v: int) -> List[Edge]:
-        pattern = '''
-        MATCH (first:VERTEX {_id: %d})-[e:EDGE]->(second:VERTEX)
-        RETURN first._id, second._id, e.weight
-        '''
-        task = pattern % (v)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self._records_to_edges(self.session.run(task))
+        return list(self._records_to_edges(self._stream(self._q['edges_from'], v=v)))
 
     def edges_to(self, v: int) -> List[Edge]:
-        pattern = '''
-        MATCH (first:VERTEX)-[e:EDGE]->(second:VERTEX {_id: %d})
-        RETURN first._id, second._id, e.weight
-        '''
-        task = pattern % (v)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self._records_to_edges(self.session.run(task))
+        return list(self._records_to_edges(self._stream(self._q['edges_to'], v=v)))
 
     def edges_related(self, v: int) -> List[Edge]:
-        pattern = '''
-        MATCH (first:VERTEX {_id: %d})-[e:EDGE]-(second:VERTEX)
-        RETURN first._id, second._id, e.weight
-        '''
-        task = pattern % (v)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self._records_to_edges(self.session.run(task))
+        return list(self._records_to_edges(self._stream(self._q['edges_related'], v=v)))
 
     # Wider range of neighbors
 
     def edges_related_to_group(self, vs: Sequence[int]) -> List[Edge]:
-        pattern = '''
-        MATCH (first:VERTEX)-[e:EDGE]-(second:VERTEX)
-        WHERE (first._id IN [%s]) AND NOT (second._id IN [%s])
-        RETURN first._id, second._id, e.weight
-        '''
-        group_members = ','.join([str(v) for v in vs])
-        task = pattern % (group_members, group_members)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self._records_to_edges(self.session.run(task))
+        vs = [int(v) for v in vs]
+        return list(self._records_to_edges(self._stream(self._q['edges_related_to_group'], vs=vs)))
 
     def neighbors_of_group(self, vs: Sequence[int]) -> Set[int]:
-        pattern = '''
-        MATCH (first:VERTEX)-[:EDGE]-(second:VERTEX)
-        WHERE (first._id IN [%s]) AND NOT (second._id IN [%s])
-        RETURN second._id as _id
-        '''
-        group_members = ','.join([str(v) for v in vs])
-        task = pattern % (group_members, group_members)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return {int(r['_id']) for r in self.session.run(task)}
+        vs = [int(v) for v in vs]
+        return {r[0] for r in self._stream(self._q['neighbors_of_group'], vs=vs)}
 
     def neighbors(self, v: int) -> Set[int]:
-        pattern = '''
-        MATCH (:VERTEX {_id: %d})-[:EDGE]-(v_related:VERTEX)
-        RETURN v_related._id as _id
-        '''
-        task = pattern % (v)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return {int(r['_id']) for r in self.session.run(task)}
+        return {r[0] for r in self._stream(self._q['neighbors'], v=v)}
 
     def neighbors_of_neighbors(self, v: int, include_related=False) -> Set[int]:
         if include_related:
-            pattern = '''
-            MATCH (v:VERTEX {_id: %d})-[:EDGE]-(:VERTEX)-[:EDGE]-(v_unrelated:VERTEX)
-            WHERE NOT (v._id = v_unrelated._id)
-            RETURN v_unrelated._id as _id
-            '''
-            task = pattern % v
+            task = self._q['neighbors_of_neighbors_including_related']
         else:
-            pattern = '''
-            MATCH (v:VERTEX {_id: %d})-[:EDGE]-(:VERTEX)-[:EDGE]-(v_unrelated:VERTEX)
-            WHERE NOT EXISTS {
-                MATCH (v)-[e_banned:EDGE]-(v_unrelated)
-            } AND NOT (v._id = v_unrelated._id)
-            RETURN v_unrelated._id as _id
-            '''
-            task = pattern % v
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return {int(r['_id']) for r in self.session.run(task)}
+            task = self._q['neighbors_of_neighbors']
+        return {r[0] for r in self._stream(task, v=v)}
 
     def shortest_path(self, first, second) -> (List[int], float):
-        pattern = '''
-        MATCH (first:VERTEX {_id: %d}), (second:VERTEX {_id: %d})
-        CALL algo.shortestPath.stream(first, second, "weight")
-        YIELD nodeId, weight
-        MATCH (v_on_path:Loc) WHERE id(v_on_path) = nodeId
-        RETURN v_on_path._id AS _id, weight
-        '''
-        task = pattern % (first, second)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        rs = list(self.session.run(task))
-        path = [int(r['_id']) for r in rs]
-        weight = sum([float(r['weight']) for r in rs])
+        """
+            Runs Dijkstra inside of Neo4J through the Graph Data Science library.
+            The in-memory projection it needs is created lazily and
+            recreated after the graph is modified.
+        """
+        self._ensure_projection()
+        rs = self._read(
+            self._q['shortest_path'],
+            projection=self._projection_name,
+            first=first,
+            second=second,
+        )
+        if len(rs) == 0:
+            return [], 0
+        path = [int(v) for v in rs[0]['path']]
+        weight = float(rs[0]['weight'])
         return path, weight
 
     # Metadata
 
-    def reduce_nodes(self) -> int:
-        task = f'''
-        MATCH (v:{self._v})
-        WITH count(v) as result
-        RETURN result
-        '''
-        return int(self._first_record(self.session.run(task), 'result'))
-
-    def reduce_edges(self, **kwargs) -> int:
-        task = f'''
-        MATCH ()-[e:{self._e}]->()
-        WITH count(e) as result
-        RETURN result
-        '''
-        return int(self._first_record(self.session.run(task), 'result'))
+    def reduce_nodes(self) -> GraphDegree:
+        # Nodes have no weights here.
+        return GraphDegree(int(self._first_record(self._read(self._q['reduce_nodes']), 'result')), 0)
+
+    def reduce_edges(self, u=None, v=None, key=None) -> GraphDegree:
+        # Edge labels aren't stored in Neo4J, so `key` is ignored.
+        u = self.make_node_id(u)
+        v = self.make_node_id(v)
+        if u < 0 and v < 0:
+            return GraphDegree(*self._degree(self._q['reduce_edges']))
+        elif u == v or u < 0 or v < 0:
+            # All the degrees of a single node come in one round-trip.
+            ingoing, outgoing, related = self.degrees(max(u, v))
+            if u == v or not self.directed:
+                return related
+            return ingoing if u < 0 else outgoing
+        es = self.has_edge(u, v)
+        return GraphDegree(len(es), float(sum(e.weight for e in es)))
+
+    def count_followers_many(self, vs: Sequence[int]) -> Sequence[int]:
+        task = 'count_followers_many' if self.directed else 'count_related_many'
+        return self._count_many(self._q[task], vs)
+
+    def count_following_many(self, vs: Sequence[int]) -> Sequence[int]:
+        task = 'count_following_many' if self.directed else 'count_related_many'
+        return self._count_many(self._q[task], vs)
 
     def degree_neighbors(self, v: int) -> (int, float):
-        pattern = '''
-        MATCH (v:VERTEX {_id: %d})-[e:EDGE]-()
-        WITH count(e) as c, sum(e.weight) as s
-        RETURN c, s
-        '''
-        task = pattern % v
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        rs = list(self.session.run(task))
-        c = int(self._first_record(rs, 'c'))
-        s = float(self._first_record(rs, 's'))
-        return c, s
+        return self._degree(self._q['degree_neighbors'], v)
 
     def degree_predecessors(self, v: int) -> (int, float):
-        pattern = '''
-        MATCH (:VERTEX)-[e:EDGE]->(v:VERTEX {_id: %d})
-        WITH count(e) as c, sum(e.weight) as s
-        RETURN c, s
-        '''
-        task = pattern % v
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        rs = list(self.session.run(task))
-        c = int(self._first_record(rs, 'c'))
-        s = float(self._first_record(rs, 's'))
-        return c, s
+        return self._degree(self._q['degree_predecessors'], v)
 
     def degree_successors(self, v: int) -> (int, float):
-        pattern = '''
-        MATCH (v:VERTEX {_id: %d})-[e:EDGE]->(:VERTEX)
-        WITH count(e) as c, sum(e.weight) as s
-        RETURN c, s
-        '''
-        task = pattern % v
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        rs = list(self.session.run(task))
-        c = int(self._first_record(rs, 'c'))
-        s = float(self._first_record(rs, 's'))
-        return c, s
+        return self._degree(self._q['degree_successors'], v)
+
+    def degrees(self, v: int) -> Tuple[GraphDegree, GraphDegree, GraphDegree]:
+        """
+            Computes ingoing, outgoing and total degrees of `v` in a single round-trip.
+            Prefer this over separate `degree_*` calls, when several are needed.
+        """
+        rs = self._read(self._q['degrees'], v=v)
+        if len(rs) == 0:
+            return GraphDegree(0, 0), GraphDegree(0, 0), GraphDegree(0, 0)
+        r = rs[0]
+        ingoing = GraphDegree(int(r['in_count']), float(r['in_sum'] or 0))
+        outgoing = GraphDegree(int(r['out_count']), float(r['out_sum'] or 0))
+        related = GraphDegree(
+            ingoing.count + outgoing.count,
+            ingoing.weight + outgoing.weight,
+        )
+        return ingoing, outgoing, related
+
+    def _count_related(self, v: int) -> int:
+        return self.degrees(v)[2].count
 
     def biggest_edge_id(self) -> int:
-        task = '''
-        MATCH (:VERTEX)-[e:EDGE]->(:VERTEX)
-        RETURN e._id AS _id
-        ORDER BY _id DESC
-        LIMIT 1
-        '''
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        rs = list(self.session.run(task))
+        rs = self._read(self._q['biggest_edge_id'])
         if len(rs) == 0:
             return 0
         return int(self._first_record(rs, '_id'))
 
+    @invalidates_caches
     def add(self, e: Edge, **kwargs) -> bool:
         """
             CAUTION: True Upserting is too slow, if indexing isn't enabled,
@@ -350,133 +494,94 @@ class Neo4J(BaseAPI):
             So for the non-enterprise version - we strongly recommend 
             using `insert_edge()`
         """
-        pattern = '''
-        MERGE (first:VERTEX {_id: %d})
-        MERGE (second:VERTEX {_id: %d})
-        MERGE (first)-[:EDGE {_id: %d, weight: %d}]%s(second)
-        '''
-        d = '->' if e.is_directed else '-'
-        task = pattern % (e.first, e.second, e._id, e.weight, d)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        self.session.run(task)
+        task = self._q['add_directed' if e.is_directed else 'add_undirected']
+        self._run(task, first=e.first, second=e.second, _id=e._id, weight=e.weight)
         return True
 
+    @invalidates_caches
     def insert_edge(self, e: Edge) -> bool:
-        pattern = '''
-        MERGE (first:VERTEX {_id: %d})
-        MERGE (second:VERTEX {_id: %d})
-        CREATE (first)-[:EDGE {_id: %d, weight: %d}]%s(second)
-        '''
-        d = '->' if e.is_directed else '-'
-        task = pattern % (e.first, e.second, e._id, e.weight, d)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        self.session.run(task)
+        task = self._q['insert_edge_directed' if e.is_directed else 'insert_edge_undirected']
+        self._run(task, first=e.first, second=e.second, _id=e._id, weight=e.weight)
         return True
 
+    @invalidates_caches
     def insert_edges(self, es: List[Edge]) -> int:
-        vs = set()
-        for e in es:
-            vs.add(e.first)
-            vs.add(e.second)
-        task = str()
-        # First upsert all the nodes.
-        for v in vs:
-            pattern = 'MERGE (v%d:VERTEX {_id: %d})'
-            part = (pattern % (v, v))
-            task += part
-            task += '\n'
-        # Then add the edges connecting matched nodes.
-        for e in es:
-            pattern = 'CREATE (v%d)-[:EDGE {_id: %d, weight: %d}]%s(v%d)'
-            d = '->' if e.is_directed else '-'
-            part = (pattern %
-                    (e.first, e._id, e.weight, d, e.second))
-            task += part
-            task += '\n'
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        self.session.run(task)
+        """
+            Uses a fixed parameterized query for every batch,
+            so Neo4J can reuse the cached execution plan.
+        """
+        for is_directed in (True, False):
+            rows = [{
+                'first': e.first,
+                'second': e.second,
+                '_id': e._id,
+                'weight': e.weight,
+            } for e in es if bool(e.is_directed) == is_directed]
+            if len(rows) == 0:
+                continue
+            task = self._q['insert_edges_directed' if is_directed else 'insert_edges_undirected']
+            self._run(task, rows=rows)
         return len(es)
 
+    @invalidates_caches
     def remove_node(self, v: int):
-        pattern = '''
-        MATCH (v:VERTEX {_id: %d})
-        DETACH DELETE v
-        '''
-        task = pattern % v
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        return self.session.run(task)
+        return self._run(self._q['remove_node'], v=v)
 
+    @invalidates_caches
     def remove(self, e: Edge) -> bool:
-        task = str()
+        suffix = 'directed' if e.is_directed else 'undirected'
         if e._id < 0:
-            pattern = '''
-            MATCH (first:VERTEX {_id: %d})
-            MATCH (second:VERTEX {_id: %d})
-            MATCH (first)-[e:EDGE]%s(second)
-            DELETE e
-            '''
-            d = '->' if e.is_directed else '-'
-            task = pattern % (e.first, e.second, d)
+            self._run(self._q['remove_by_members_' + suffix],
+                      first=e.first, second=e.second)
         else:
-            # We provide excessive information on node IDs
-            # to use property indexes.
-            pattern = '''
-            MATCH (first:VERTEX {_id: %d})
-            MATCH (second:VERTEX {_id: %d})
-            MATCH (first)-[e:EDGE {_id: %d}]%s(second)
-            DELETE e
-            '''
-            d = '->' if e.is_directed else '-'
-            task = pattern % (e.first, e.second, e._id, d)
-        task = task.replace('VERTEX', self._v)
-        task = task.replace('EDGE', self._e)
-        self.session.run(task)
+            self._run(self._q['remove_by_id_' + suffix],
+                      first=e.first, second=e.second, _id=e._id)
         return True
 
+    @invalidates_caches
     def clear(self):
-        self.session.run(f'MATCH (v:{self._v}) DETACH DELETE v')
-        idxs = self.get_indexes()
-        if f'index{self._v}' in idxs:
-            self.session.run(f'DROP INDEX index{self._v}')
-        cs = self.get_constraints()
-        if f'constraint{self._v}' in cs:
-            self.session.run(f'DROP CONSTRAINT constraint{self._v}')
-        if f'constraint{self._e}' in cs:
-            self.session.run(f'DROP CONSTRAINT constraint{self._e}')
+        # Constraints created in `__init__` are kept, so the following
+        # `MERGE`s and `MATCH`es on `_id` stay indexed.
+        self._run(f'MATCH (v:{self._v}) DETACH DELETE v')
 
+    @invalidates_caches
     def add_stream(self, stream, **kwargs) -> int:
         chunk_len = Neo4J.__max_batch_size__
         count_edges_added = 0
         for es in chunks(stream, chunk_len):
-            count_edges_added += self.insert_edges(es)
+            count_edges_added += self.insert_edges(sort_edges_by_members(es))
         return count_edges_added
 
+    @invalidates_caches
+    def add_stream_parallel(self, stream, thread_count=8, **kwargs) -> int:
+        # Workers can't join the transaction of this thread.
+        if thread_count <= 1 or self.in_transaction():
+            return self.add_stream(stream)
+        # `add` only accepts single edges here, so batches go through `insert_edges`.
+        # Every worker borrows its own session from the pool of the driver.
+        return self.map_chunks_parallel(stream, self.insert_edges, thread_count)
+
+    @invalidates_caches
     def add_from_csv(self, filepath: str, is_directed=True) -> int:
         """
             This function may be tricky to use!
 
-            CAUTION 1: This operation makes a temporary copy of the entire dump 
-            and places it into pre-specified `import_directory`:
+            CAUTION 1: This operation symlinks the dump into the pre-specified
+            `import_directory`, so Neo4J must be running on the same machine:
             https://neo4j.com/docs/operations-manual/4.0/configuration/file-locations/
+            If the link can't be created, edges are streamed over Bolt instead.
 
             CAUTION 2: This frequently fails with following error:
             `neobolt.exceptions.DatabaseError`: "Java heap space".
         """
-        cnt = self.number_of_edges()
-        current_id = self.biggest_edge_id() + 1
         _, filename = os.path.split(filepath)
+        file_link = self._link_into_import_directory(filepath)
+        if file_link is None:
+            return self._add_csv_through_bolt(filepath, is_directed)
 
-        # We will need to link the file to import folder.
-        file_link = os.path.expanduser(self.import_directory)
-        file_link = os.path.join(file_link, filename)
-        file_link = os.path.abspath(file_link)
-
+        cnt = self.number_of_edges()
+        current_id = self.biggest_edge_id() + 1
         try:
-            shutil.copy(filepath, file_link)
             # https://neo4j.com/docs/cypher-manual/current/clauses/load-csv/#load-csv-importing-large-amounts-of-data
             pattern_full = '''
             LOAD CSV WITH HEADERS FROM '%s' AS row
@@ -487,43 +592,42 @@ class Neo4J(BaseAPI):
                 toInteger(linenumber()) AS idx
             MERGE (first:VERTEX {_id: id_from})
             MERGE (second:VERTEX {_id: id_to})
-            CREATE (first)-[:EDGE {_id: idx + %d, weight: w}]%s(second)
+            CREATE (first)-[:EDGE {_id: idx + %d, weight: w, is_directed: %s}]->(second)
             '''
-            d = '->' if is_directed else '-'
+            d = 'true' if is_directed else 'false'
             task = pattern_full % (
                 'file:///' + filename, current_id, d
             )
             task = task.replace('VERTEX', self._v)
             task = task.replace('EDGE', self._e)
             print('task is:', task)
-            self.session.run(task)
+            self._run(task)
         finally:
-            # Don't forget to copy temporary file!
+            # Don't forget to remove the temporary link!
             os.unlink(file_link)
         return self.number_of_edges() - cnt
 
+    @invalidates_caches
     def insert_adjacency_list_in_parts(self, filepath: str, is_directed=True) -> int:
         """
             This function may be tricky to use!
 
-            CAUTION 1: This operation makes a temporary copy of the entire dump 
-            and places it into pre-specified `import_directory`:
+            CAUTION 1: This operation symlinks the dump into the pre-specified
+            `import_directory`, so Neo4J must be running on the same machine:
             https://neo4j.com/docs/operations-manual/4.0/configuration/file-locations/
+            If the link can't be created, edges are streamed over Bolt instead.
 
             CAUTION 2: This frequently fails with following error:
             `neobolt.exceptions.DatabaseError`: "Java heap space".
         """
-        cnt = self.number_of_edges()
-        current_id = self.biggest_edge_id() + 1
         _, filename = os.path.split(filepath)
+        file_link = self._link_into_import_directory(filepath)
+        if file_link is None:
+            return self._add_csv_through_bolt(filepath, is_directed)
 
-        # We will need to link the file to import folder.
-        file_link = os.path.expanduser(self.import_directory)
-        file_link = os.path.join(file_link, filename)
-        file_link = os.path.abspath(file_link)
-
+        cnt = self.number_of_edges()
+        current_id = self.biggest_edge_id() + 1
         try:
-            shutil.copy(filepath, file_link)
             # https://neo4j.com/docs/cypher-manual/current/clauses/load-csv/#load-csv-importing-large-amounts-of-data
             pattern_nodes = '''
             USING PERIODIC COMMIT %d
@@ -544,10 +648,10 @@ class Neo4J(BaseAPI):
                 toInteger(linenumber()) AS idx
             MATCH (first:VERTEX {_id: id_from})
             MATCH (second:VERTEX {_id: id_to})
-            CREATE (first)-[e:EDGE {_id: idx + %d, weight: w}]%s(second)
+            CREATE (first)-[e:EDGE {_id: idx + %d, weight: w, is_directed: %s}]->(second)
             RETURN count(e)
             '''
-            d = '->' if is_directed else '-'
+            d = 'true' if is_directed else 'false'
             tasks = [
                 pattern_nodes % (
                     Neo4J.__max_batch_size__, 'file:///' + filename
@@ -559,20 +663,140 @@ class Neo4J(BaseAPI):
             for task in tasks:
                 task = task.replace('VERTEX', self._v)
                 task = task.replace('EDGE', self._e)
-                self.session.run(task)
+                self._run(task)
         finally:
-            # Don't forget to copy temporary file!
+            # Don't forget to remove the temporary link!
             os.unlink(file_link)
         return self.number_of_edges() - cnt
 
+    def _link_into_import_directory(self, filepath: str) -> Optional[str]:
+        """
+            Symlinks the file into `import_directory` instead of copying it,
+            so the dump isn't written to disk twice.
+            Returns `None` if the link can't be created.
+        """
+        _, filename = os.path.split(filepath)
+        file_link = os.path.expanduser(self.import_directory)
+        file_link = os.path.join(file_link, filename)
+        file_link = os.path.abspath(file_link)
+        try:
+            os.symlink(os.path.abspath(filepath), file_link)
+        except OSError:
+            return None
+        return file_link
+
+    def _add_csv_through_bolt(self, filepath: str, is_directed=True) -> int:
+        current_id = self.biggest_edge_id() + 1
+
+        def with_shifted_ids(es):
+            for e in es:
+                e._id += current_id
+                yield e
+
+        return self.add_stream(with_shifted_ids(
+            yield_edges_from_csv(filepath, is_directed=is_directed)))
+
+    @contextmanager
+    def transaction(self):
+        """
+            Temporarily routes all the queries into
+            an explicit transaction, committed on exit.
+        """
+        if self._tx is not None:
+            yield self
+            return
+        with self.driver.session() as session:
+            tx = session.begin_transaction()
+            self._tx = tx
+            try:
+                yield self
+                tx.commit()
+            except Exception as e:
+                tx.rollback()
+                raise e
+            finally:
+                tx.close()
+                self._tx = None
+                self.invalidate_caches()
+
     # ---
     # Helper methods.
     # ---
 
-    def _records_to_edges(self, records) -> List[Edge]:
-        if isinstance(records, Neo4jResult):
-            records = list(records)
-        return [Edge(r['first._id'], r['second._id'], r['e.weight']) for r in records]
+    def in_transaction(self) -> bool:
+        return self._tx is not None
+
+    @property
+    def _tx(self):
+        return getattr(self._local, 'tx', None)
+
+    @_tx.setter
+    def _tx(self, tx):
+        self._local.tx = tx
+
+    def _run(self, task: str, **params) -> list:
+        if self._tx is not None:
+            return list(self._tx.run(task, **params))
+        with self.driver.session() as session:
+            return list(session.run(task, **params))
+
+    def _read(self, task: str, **params) -> list:
+        """
+            Same as `_run`, but outside of explicit transactions
+            lets the driver route the query to a read replica.
+        """
+        if self._tx is not None:
+            return list(self._tx.run(task, **params))
+        with self.driver.session() as session:
+            return session.read_transaction(lambda tx: list(tx.run(task, **params)))
+
+    def _stream(self, task: str, **params) -> Generator[dict, None, None]:
+        """
+            Yields records as they arrive over Bolt, instead of collecting
+            them first, so big neighborhoods are never held in memory twice.
+            The session stays open until the generator is exhausted.
+        """
+        if self._tx is not None:
+            yield from self._tx.run(task, **params)
+            return
+        with self.driver.session(default_access_mode=READ_ACCESS) as session:
+            yield from session.run(task, **params)
+
+    def _records_to_edges(self, records) -> Generator[Edge, None, None]:
+        # Expects `first._id, second._id, e.weight` columns in that order.
+        # Positional access skips the key lookups, and IDs already arrive as `int`s.
+        return (Edge(r[0], r[1], r[2]) for r in records)
+
+    def _ensure_projection(self):
+        if self._projection_is_fresh:
+            return
+        self._run(self._q['drop_graph'], projection=self._projection_name)
+        self._run(
+            self._q['project_graph'],
+            projection=self._projection_name,
+            orientation='NATURAL' if self.directed else 'UNDIRECTED',
+        )
+        self._projection_is_fresh = True
+
+    def invalidate_caches(self):
+        super().invalidate_caches()
+        # Dropping the stale projection is postponed until it's needed.
+        self._projection_is_fresh = False
+
+    def _degree(self, task: str, v: Optional[int] = None) -> (int, float):
+        rs = self._read(task) if v is None else self._read(task, v=v)
+        c = int(self._first_record(rs, 'c') or 0)
+        s = float(self._first_record(rs, 's') or 0)
+        return c, s
+
+    def _count_many(self, task: str, vs: Sequence[int]) -> Sequence[int]:
+        vs = [int(v) for v in vs]
+        if len(vs) == 0:
+            return []
+        # Repeated IDs would land in the same group and multiply its count.
+        unique_vs = list(set(vs))
+        counts = {r[0]: int(r[1]) for r in self._stream(task, vs=unique_vs)}
+        return [counts.get(v, 0) for v in vs]
 
     def _first_record(self, records, key):
         if isinstance(records, Neo4jResult):
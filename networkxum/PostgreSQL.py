@@ -1,3 +1,5 @@
+from sqlalchemy.dialects.postgresql import insert as postgres_insert
+
 from PyStorageGraph.BaseSQL import *
 
 
@@ -16,6 +18,14 @@ class PostgreSQL(BaseSQL):
         BaseSQL.__init__(self, url, **kwargs)
         self.set_pragmas_on_first_launch()
 
+    def engine_options(self) -> dict:
+        options = super().engine_options()
+        # Lets `psycopg2` pack batches into multi-row `INSERT ... VALUES` statements.
+        # https://docs.sqlalchemy.org/en/14/dialects/postgresql.html#psycopg2-executemany-mode
+        options['executemany_mode'] = 'values_plus_batch'
+        options['executemany_values_page_size'] = 1000
+        return options
+
     def set_pragmas_on_first_launch(self):
         if self.number_of_edges() > 0:
             return
@@ -47,6 +57,14 @@ class PostgreSQL(BaseSQL):
     #     self.upsert_table(EdgeNewSQL.__tablename__)
     #     return self.number_of_edges() - cnt
 
+    def upsert_statement(self, target_class, columns):
+        # https://docs.sqlalchemy.org/en/14/dialects/postgresql.html#insert-on-conflict-upsert
+        statement = postgres_insert(target_class.__table__)
+        return statement.on_conflict_do_update(
+            index_elements=['_id'],
+            set_={c: statement.excluded[c] for c in columns if c != '_id'},
+        )
+
     def upsert_table(self, source_name: str):
         # https://stackoverflow.com/a/17267423/2766161
         migration = f'''
@@ -55,6 +73,6 @@ class PostgreSQL(BaseSQL):
             ON CONFLICT (_id) DO UPDATE SET
             (first, second, weight, attributes_json) = (EXCLUDED.first, EXCLUDED.second, EXCLUDED.weight, EXCLUDED.attributes_json);
         '''
+        # Committed by `get_session`, or by the outer `transaction`.
         with self.get_session() as s:
             s.execute(migration)
-            s.commit()
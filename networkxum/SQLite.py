@@ -1,6 +1,17 @@
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
 from PyStorageGraph.BaseSQL import *
 
 
+def upsert_statement_sqlite(target_class, columns):
+    # https://docs.sqlalchemy.org/en/14/dialects/sqlite.html#insert-on-conflict-upsert
+    statement = sqlite_insert(target_class.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=['_id'],
+        set_={c: statement.excluded[c] for c in columns if c != '_id'},
+    )
+
+
 class SQLiteMem(BaseSQL):
     """
         In-memory version of SQLite database.
@@ -10,6 +21,9 @@ class SQLiteMem(BaseSQL):
     __edge_type__ = EdgeSQL
     __in_memory__ = True
 
+    def upsert_statement(self, target_class, columns):
+        return upsert_statement_sqlite(target_class, columns)
+
 
 class SQLite(BaseSQL):
     """
@@ -31,6 +45,9 @@ class SQLite(BaseSQL):
         BaseSQL.__init__(self, url, **kwargs)
         self.set_pragmas_on_first_launch()
 
+    def upsert_statement(self, target_class, columns):
+        return upsert_statement_sqlite(target_class, columns)
+
     def set_pragmas_on_first_launch(self):
         if self.number_of_edges() > 0:
             return
@@ -6,6 +6,7 @@ import random
 from random import SystemRandom
 from pathlib import Path
 import collections
+from operator import attrgetter
 
 
 from .Edge import Edge
@@ -54,6 +55,15 @@ def chunks(iterable, size) -> Generator[list, None, None]:
         yield current
 
 
+def sort_edges_by_members(es: Sequence[Edge]) -> List[Edge]:
+    """
+        Orders a batch of edges by source and then target node ID.
+        Backends with B-Tree indexes will touch their pages sequentially
+        when such batches are inserted.
+    """
+    return sorted(es, key=attrgetter('first', 'second'))
+
+
 def extract_database_name(url: str, default='graph') -> Tuple[str, str]:
     url = urlparse(url)
     address = f'{url.scheme}://{url.netloc}'
@@ -4,7 +4,13 @@ from pathlib import Path
 import sys
 import os.path
 
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
 from .Edge import Edge
+from .Algorithms import chunks
 
 
 def allow_big_csv_fields():
@@ -27,7 +33,53 @@ def allow_big_csv_fields():
 
 # region Graphs
 
+def yield_edge_dicts_from_csv(filepath: str, chunk_len: int = 500000, is_directed=True, id_offset: int = 0) -> Generator[List[dict], None, None]:
+    """
+        Parses the adjacency list in chunks of `chunk_len` rows,
+        producing plain dicts, ready for bulk inserts.
+        Edge IDs are row numbers, starting from `id_offset`.
+        Uses vectorized `pandas` parser, if it's installed.
+    """
+    if pd is None:
+        for es in chunks(yield_edges_from_csv(filepath, is_directed=is_directed), chunk_len):
+            yield [dict(_id=e._id + id_offset, first=e.first, second=e.second, weight=e.weight, is_directed=e.is_directed) for e in es]
+        return
+
+    idx_start = id_offset
+    for df in yield_frames_from_csv(filepath, chunk_len):
+        df.insert(0, '_id', range(idx_start, idx_start + len(df)))
+        df['is_directed'] = is_directed
+        idx_start += len(df)
+        yield df.to_dict('records')
+
+
+def yield_frames_from_csv(filepath: str, chunk_len: int):
+    """
+        Yields `pandas.DataFrame` chunks with `first`, `second` and `weight` columns.
+        Just like `yield_edges_from_csv`, skips rows without both members
+        and assumes unit weights, where those are missing.
+    """
+    reader = pd.read_csv(filepath, header=0, chunksize=chunk_len)
+    for df in reader:
+        df = df.iloc[:, :3].copy()
+        df.columns = ['first', 'second', 'weight'][:len(df.columns)]
+        df = df.dropna(subset=['first', 'second'])
+        if 'weight' not in df:
+            df['weight'] = 1.0
+        df = df.astype({'first': 'int64', 'second': 'int64', 'weight': 'float64'})
+        df['weight'] = df['weight'].fillna(1.0)
+        yield df
+
+
 def yield_edges_from_csv(filepath: str, edge_type: type = Edge, is_directed=True) -> Generator[Edge, None, None]:
+    if pd is not None:
+        idx = 0
+        for df in yield_frames_from_csv(filepath, 500000):
+            for first, second, w in zip(df['first'].tolist(), df['second'].tolist(), df['weight'].tolist()):
+                yield edge_type(_id=idx, first=first, second=second, weight=w, is_directed=is_directed)
+                idx += 1
+        return
+
     with open(filepath, 'r') as f:
         reader = csv.reader(f, delimiter=',')
         # Skip the header line.
@@ -44,6 +96,11 @@ def yield_edges_from_csv(filepath: str, edge_type: type = Edge, is_directed=True
 
 
 def import_graph(gdb, filepath: str) -> int:
+    """
+        Appends all the edges from the adjacency list CSV file.
+        Backends with a dedicated `add_from_csv` bulk-load the rows under new IDs
+        instead of upserting them, so importing the same file twice duplicates edges.
+    """
     if filepath.endswith('.csv'):
         if hasattr(gdb, 'add_from_csv'):
             return gdb.add_from_csv(filepath)
@@ -0,0 +1,55 @@
+import collections
+
+
+class SegmentedCache:
+    """
+        A bounded cache, split into a small LRU admission window
+        and a big "frozen" region for entries hit at least twice.
+        One-off lookups only churn the window, so results for hub
+        nodes of power-law graphs survive long scans.
+    """
+
+    def __init__(self, capacity: int = 100000, window_share: float = 0.1, hits_to_freeze: int = 2):
+        self.window_capacity = max(1, int(capacity * window_share))
+        self.frozen_capacity = max(1, capacity - self.window_capacity)
+        self.hits_to_freeze = hits_to_freeze
+        self.frozen = dict()
+        # Maps keys to `[value, hits]` pairs.
+        self.window = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.frozen) + len(self.window)
+
+    def get(self, key, default=None):
+        if key in self.frozen:
+            return self.frozen[key]
+        entry = self.window.get(key)
+        if entry is None:
+            return default
+        entry[1] += 1
+        if entry[1] >= self.hits_to_freeze:
+            del self.window[key]
+            self._freeze(key, entry[0])
+        else:
+            self.window.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        if key in self.frozen:
+            self.frozen[key] = value
+            return
+        self.window[key] = [value, 1]
+        self.window.move_to_end(key)
+        while len(self.window) > self.window_capacity:
+            self.window.popitem(last=False)
+
+    def clear(self):
+        self.frozen.clear()
+        self.window.clear()
+
+    def _freeze(self, key, value):
+        if len(self.frozen) >= self.frozen_capacity:
+            # Dicts preserve the insertion order, so this
+            # evicts the entry that was frozen the earliest.
+            del self.frozen[next(iter(self.frozen))]
+        self.frozen[key] = value
@@ -1,5 +1,6 @@
 from .Edge import *
 from .Node import *
 from .GraphDegree import *
+from .SegmentedCache import *
 from .Algorithms import *
 from .Parsing import *